@@ -4,6 +4,7 @@ import json
 import requests
 import threading
 import os
+from catalog_client import CatalogClient
 
 class EmergencySystem:
     def __init__(self, emergency_info, resource_catalog_file):
@@ -20,14 +21,17 @@ class EmergencySystem:
         self.clientID = info["ID"]
         self.client = MyMQTT(self.clientID, self.broker, self.port, None)
         self.info = emergency_info
+        catalog_url = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}'
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=emergency_info)
 
     def register(self):
-        request_string = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}/registerResource'
-        data = json.load(open(self.info))
-        try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
-        except Exception as e:
-            print(f'Error during registration: {e}')
+        # the catalog expires resources that stop sending heartbeats, so refresh every 10 seconds
+        while True:
+            try:
+                self.catalog_client.refresh()
+            except Exception as e:
+                print(f'Error during registration: {e}')
+            time.sleep(10)
 
     def start(self):
         self.client.start()
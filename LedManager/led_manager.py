@@ -4,6 +4,7 @@ import json
 import requests
 import threading
 import os
+from catalog_client import CatalogClient
 
 class LedManager:
     def __init__(self, ledmanager_info, resource_catalog_info):
@@ -26,15 +27,16 @@ class LedManager:
                 self.topicE = s["topic_emergency"] #topic on which it publishes messages for the acrivations of leds in emergency cases
         self.clientID = info["Name"]
         self.client = MyMQTT(self.clientID, self.broker, self.port, self) #configure MQTT
+        # full registration only when led_manager_info.json changes, heartbeats otherwise
+        catalog_url = 'http://' + self.resource_catalog_info["ip_address"] + ':' + self.resource_catalog_info["ip_port"]
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=self.led_manager_file)
 
     def register(self):
         '''
         periodicallty registers itself to the resource catalog to confirm it is active
         '''
-        request_string = 'http://' + self.resource_catalog_info["ip_address"] + ':' + self.resource_catalog_info["ip_port"] + '/registerResource'
-        data = json.load(open(self.led_manager_file))
         try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
+            r = self.catalog_client.refresh()
             print(f'Response: {r.text}')
         except:
             print("An error occurred during registration")
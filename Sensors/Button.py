@@ -7,6 +7,7 @@ import threading
 import os
 import signal
 import sys
+from catalog_client import CatalogClient
 
 class PedestrianButton:
     def __init__(self, button_info, resource_catalog_file):
@@ -27,11 +28,12 @@ class PedestrianButton:
         self.last_message_time = 0
 
     def register(self):
+        # full registration only when button_info changes, heartbeats otherwise
+        catalog_url = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}'
+        catalog_client = CatalogClient(catalog_url, resource_info_path=self.button_info)
         while self.running:
-            request_string = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}/registerResource'
-            data = json.load(open(self.button_info))
             try:
-                r = requests.put(request_string, json.dumps(data, indent=4))
+                r = catalog_client.refresh()
                 print(f'Response: {r.text}')
             except Exception as e:
                 print(f'Error during registration: {e}')
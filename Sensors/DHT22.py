@@ -5,6 +5,8 @@ from MyMQTT import MyMQTT
 import json
 import os
 import requests
+import threading
+from catalog_client import CatalogClient
 
 # Load configuration from JSON
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -90,20 +92,22 @@ class DHTPublisher:
         print(f"Published: Temp: {temperature}°C, Humidity: {humidity}%")
 
     def register(self, sensor_info_path, catalog):
-        try:
-            with open(sensor_info_path) as f:
-                data = json.load(f)
-            url = f"http://{catalog['ip_address']}:{catalog['ip_port']}/registerResource"
-            r = requests.put(url, json.dumps(data, indent=4))
-            print(f"Registered to resource catalog. Response: {r.text}")
-        except Exception as e:
-            print(f"Registration failed: {e}")
+        # the catalog expires resources that stop sending heartbeats, so refresh every 10 seconds
+        catalog_client = CatalogClient(f"http://{catalog['ip_address']}:{catalog['ip_port']}",
+                                       resource_info_path=sensor_info_path)
+        while True:
+            try:
+                r = catalog_client.refresh()
+                print(f"Registered to resource catalog. Response: {r.text}")
+            except Exception as e:
+                print(f"Registration failed: {e}")
+            time.sleep(10)
 
 
 # MAIN
 
 publisher = DHTPublisher(clientID, BROKER, PORT)
-publisher.register(sensor_info_path, catalog)
+threading.Thread(target=publisher.register, args=(sensor_info_path, catalog), daemon=True).start()
 publisher.start()
 
 sensor = adafruit_dht.DHT22(DHT_PIN)
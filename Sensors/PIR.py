@@ -5,6 +5,7 @@ import requests
 from gpiozero import MotionSensor
 import threading
 import os
+from catalog_client import CatalogClient
 
 class PresenceSensor:
     def __init__(self, PIR_info, resource_catalog_file):
@@ -22,15 +23,18 @@ class PresenceSensor:
         self.client = MyMQTT(self.clientID, self.broker, self.port, None)
         self.pir = MotionSensor(17)
         self.PIR_info = PIR_info
+        catalog_url = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}'
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=PIR_info)
 
     def register(self):
-        request_string = f'http://{self.resource_catalog["ip_address"]}:{self.resource_catalog["ip_port"]}/registerResource'
-        data = json.load(open(self.PIR_info))
-        try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
-            print(f'Response: {r.text}')
-        except:
-            print("An error occurred during registration")
+        # the catalog expires resources that stop sending heartbeats, so refresh every 10 seconds
+        while True:
+            try:
+                r = self.catalog_client.refresh()
+                print(f'Response: {r.text}')
+            except:
+                print("An error occurred during registration")
+            time.sleep(10)
 
     def start(self):
         self.client.start()
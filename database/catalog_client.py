@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+
+def resource_etag(resource):
+    '''
+    fingerprint of a resource description, lastUpdate excluded
+    the resource catalog computes it the same way and returns it in the ETag header
+    '''
+    description = {k: v for k, v in resource.items() if k != 'lastUpdate'}
+    serialized = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return '"' + hashlib.sha1(serialized.encode('utf-8')).hexdigest() + '"'
+
+
+class CatalogClient:
+    '''
+    keeps a resource registered to the resource catalog
+    the full description is PUT to /registerResource only the first time and when it
+    changes, otherwise a small PUT /heartbeat (ID + ETag of the last registration) just
+    refreshes its lastUpdate on the catalog
+    the description is read from resource_info_path (re-read only when the file is
+    modified) or taken from the resource_info dict
+    '''
+
+    def __init__(self, catalog_url, resource_info_path=None, resource_info=None):
+        self.catalog_url = catalog_url.rstrip('/') #http://<ip>:<port>
+        self.resource_info_path = resource_info_path
+        self.resource_info = resource_info
+        self.session = requests.Session() #keep-alive connection to the catalog
+
+        self.info_mtime = None
+        self.etag = None #ETag of the last full registration
+
+    def load_resource_info(self):
+        if self.resource_info_path is not None:
+            mtime = os.stat(self.resource_info_path).st_mtime
+            if mtime != self.info_mtime or self.resource_info is None:
+                with open(self.resource_info_path) as f:
+                    self.resource_info = json.load(f)
+                self.info_mtime = mtime
+        return self.resource_info
+
+    def register(self):
+        '''
+        full registration of the resource description
+        '''
+        resource = self.load_resource_info()
+        r = self.session.put(f"{self.catalog_url}/registerResource", json=resource)
+        if r.status_code == 200:
+            self.etag = r.headers.get('ETag') or resource_etag(resource)
+        return r
+
+    def heartbeat(self):
+        resource = self.load_resource_info()
+        headers = {'If-Match': self.etag} if self.etag else {}
+        return self.session.put(f"{self.catalog_url}/heartbeat", json={"ID": resource["ID"]}, headers=headers)
+
+    def refresh(self):
+        '''
+        to be called periodically: registers the resource if it is unknown to the catalog
+        or its description changed, otherwise sends a heartbeat
+        returns the response of the last request
+        '''
+        resource = self.load_resource_info()
+        if self.etag is None or self.etag != resource_etag(resource):
+            return self.register()
+
+        r = self.heartbeat()
+        if r.status_code in (404, 412):
+            # the catalog lost the resource (e.g. restarted or expired it) or holds another version
+            return self.register()
+        return r
+
+
+class ServiceUnavailable(Exception):
+    # no registered instance of the service answered
+    pass
+
+
+# methods that can be sent again to another instance without being applied twice
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+def never_sent(error):
+    '''
+    True if the request failed before reaching the instance (connection refused or timed out),
+    so even a POST can be sent to another one; after a read timeout it may have been applied
+    '''
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class ServiceDiscovery:
+    '''
+    resolves the endpoints of the services registered to the resource catalog
+    (/allResources?Type=...&serviceType=...) without asking the catalog on every request:
+    the endpoints of each service are cached and a background thread refreshes them every
+    refresh_interval seconds with a conditional GET (304 when the catalog did not change)
+    if the catalog is down the last known endpoints are kept (stale) and refreshed again
+    every retry_interval seconds; only the first lookup of a service waits for the catalog
+    all the registered instances are kept: request() tries them in order and an instance
+    that fails goes after the others for failure_cooldown seconds
+    '''
+
+    def __init__(self, catalog_url, refresh_interval=15, retry_interval=2, failure_cooldown=30, timeout=5):
+        self.catalog_url = catalog_url.rstrip('/') #http://<ip>:<port>
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.failure_cooldown = failure_cooldown
+        self.timeout = timeout
+
+        # (Type, serviceType) -> {"endpoints": [...], "etag", "updated", "next_refresh", "failing", "ready"}
+        self.services = {}
+        self.failures = {} #endpoint -> time of its last failure
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def lookup(self, key, etag=None):
+        '''
+        endpoints of the instances of a service, None if the catalog did not change since etag
+        '''
+        resource_type, service_type = key
+        headers = {'If-None-Match': etag} if etag else {}
+        r = requests.get(f"{self.catalog_url}/allResources", params={"Type": resource_type, "serviceType": service_type},
+                         headers=headers, timeout=self.timeout)
+        if r.status_code == 304:
+            return None, etag
+        r.raise_for_status()
+        endpoints = []
+        for resource in r.json():
+            for details in resource.get('servicesDetails', []):
+                if details.get('serviceType') == service_type and details.get('endpoint'):
+                    endpoints.append(details['endpoint'])
+        return endpoints, r.headers.get('ETag')
+
+    def refresh(self, key):
+        with self.lock:
+            entry = self.services[key]
+            etag = entry["etag"]
+        try:
+            endpoints, etag = self.lookup(key, etag)
+        except (requests.RequestException, ValueError) as e:
+            # stale endpoints are better than none
+            if not entry["failing"]:
+                print(f"Service discovery of {key[0]} failed, using the last known endpoints: {e}")
+            with self.lock:
+                entry["failing"] = True
+                entry["next_refresh"] = time.time() + self.retry_interval
+            entry["ready"].set()
+            return
+        with self.lock:
+            if endpoints is not None:
+                entry["endpoints"] = endpoints
+            entry["etag"] = etag
+            entry["updated"] = time.time()
+            entry["failing"] = False
+            entry["next_refresh"] = time.time() + self.refresh_interval
+        entry["ready"].set()
+
+    def run(self):
+        while not self.stop_event.wait(0.5):
+            now = time.time()
+            with self.lock:
+                due = [key for key, entry in self.services.items() if entry["next_refresh"] <= now]
+            for key in due:
+                self.refresh(key)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="service_discovery", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def endpoints(self, resource_type, service_type='REST'):
+        '''
+        endpoints of the registered instances, the ones that failed recently last
+        served from the cache, only the first call for a service asks the catalog
+        '''
+        key = (resource_type, service_type)
+        with self.lock:
+            entry = self.services.get(key)
+            first = entry is None
+            if first:
+                entry = {"endpoints": [], "etag": None, "updated": None, "next_refresh": float('inf'),
+                         "failing": False, "ready": threading.Event()}
+                self.services[key] = entry
+        if first:
+            self.refresh(key)
+            self.start()
+        else:
+            entry["ready"].wait(self.timeout) #another thread is doing the first lookup
+        now = time.time()
+        with self.lock:
+            endpoints = list(entry["endpoints"])
+            failed = {e: t for e, t in self.failures.items() if now - t < self.failure_cooldown}
+        # stable sort: healthy instances in catalog order, then the failed ones, oldest failure first
+        return sorted(endpoints, key=lambda endpoint: failed.get(endpoint, 0))
+
+    def endpoint(self, resource_type, service_type='REST'):
+        endpoints = self.endpoints(resource_type, service_type)
+        return endpoints[0] if endpoints else None
+
+    def report_failure(self, endpoint):
+        with self.lock:
+            self.failures[endpoint] = time.time()
+
+    def request(self, resource_type, method, path='', service_type='REST', **kwargs):
+        '''
+        sends the request to the first instance of the service that answers, path is appended
+        to its endpoint; errors and 5xx responses of idempotent methods fail over to the next
+        instance, a POST only when it could not reach the instance (it may have been applied:
+        a timeout raises ServiceUnavailable, a 5xx is returned)
+        raises ServiceUnavailable if none answered
+        '''
+        kwargs.setdefault('timeout', 30)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        error = "no instance registered"
+        for endpoint in self.endpoints(resource_type, service_type):
+            try:
+                r = requests.request(method, endpoint.rstrip('/') + path, **kwargs)
+            except requests.RequestException as e:
+                error = str(e)
+                self.report_failure(endpoint)
+                if idempotent or never_sent(e):
+                    continue
+                break
+            if r.status_code >= 500 and idempotent:
+                error = f"HTTP {r.status_code} from {endpoint}"
+                r.close()
+                self.report_failure(endpoint)
+                continue
+            return r
+        raise ServiceUnavailable(f"{resource_type} unavailable: {error}")
+
+    def stats(self):
+        with self.lock:
+            return {f"{t}/{s}": {"endpoints": list(entry["endpoints"]), "updated": entry["updated"]}
+                    for (t, s), entry in self.services.items()}
@@ -1,23 +1,1077 @@
 import cherrypy
 import sqlite3
 import json
+import base64
+import csv
+import io
+import zlib
+import gzip
+import re
+import hashlib
+import math
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
 import time
 import threading
-import requests
+import queue
+import random
+import string
 import os
 from urllib.parse import parse_qs
+from catalog_client import CatalogClient
+from MyMQTT import MyMQTT
 
-# Dynamically set the database path
+# Dynamically set the database path, DB_PATH can move it in a mounted directory (Docker) so that
+# the WAL files next to it (database.db-wal, database.db-shm) are kept with the database
 script_dir = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(script_dir, "database.db")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(script_dir, "database.db"))
+
+# schema migrations, applied in order at startup; PRAGMA user_version is the number of applied ones
+MIGRATIONS = [
+    # 1: typed timestamp column, filled in background for the existing rows (see backfill_ts)
+    [
+        "ALTER TABLE violations ADD COLUMN ts REAL",
+        "CREATE INDEX IF NOT EXISTS idx_violations_plate_ts ON violations(plate, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_violations_station_ts ON violations(station, ts)",
+        "CREATE INDEX IF NOT EXISTS idx_violations_ts ON violations(ts)"
+    ],
+    # 2: rollups for /stats, maintained by the writer in the insert transaction, filled here for the existing rows
+    [
+        "CREATE TABLE IF NOT EXISTS violations_hourly (station INTEGER NOT NULL, hour INTEGER NOT NULL, "
+        "count INTEGER NOT NULL, PRIMARY KEY (station, hour)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_violations_hourly_hour ON violations_hourly(hour)",
+        "CREATE TABLE IF NOT EXISTS violations_daily (station INTEGER NOT NULL, day INTEGER NOT NULL, "
+        "count INTEGER NOT NULL, PRIMARY KEY (station, day)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_violations_daily_day ON violations_daily(day)",
+        "CREATE TABLE IF NOT EXISTS plate_rollup (plate TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS idx_plate_rollup_count ON plate_rollup(count)",
+        "INSERT INTO violations_hourly (station, hour, count) SELECT station, "
+        "CAST(COALESCE(ts, CAST(date AS REAL)) / 3600 AS INTEGER) * 3600, COUNT(*) FROM violations GROUP BY 1, 2",
+        "INSERT INTO violations_daily (station, day, count) SELECT station, "
+        "CAST(COALESCE(ts, CAST(date AS REAL)) / 86400 AS INTEGER) * 86400, COUNT(*) FROM violations GROUP BY 1, 2",
+        "INSERT INTO plate_rollup (plate, count) SELECT plate, COUNT(*) FROM violations GROUP BY plate"
+    ],
+    # 3: variants of the distinct plates for ?plate_fuzzy (see PLATE_VARIANTS), maintained by the writer like the rollups
+    [
+        "CREATE TABLE IF NOT EXISTS plate_variants (variant TEXT NOT NULL, plate TEXT NOT NULL, "
+        "PRIMARY KEY (variant, plate)) WITHOUT ROWID",
+        "WITH RECURSIVE positions(plate, i) AS (SELECT plate, 0 FROM plate_rollup "
+        "UNION ALL SELECT plate, i + 1 FROM positions WHERE i < length(plate)) "
+        "INSERT OR IGNORE INTO plate_variants (variant, plate) "
+        "SELECT substr(plate, 1, i - 1) || substr(plate, i + 1), plate FROM positions WHERE i > 0 "
+        "UNION ALL SELECT plate, plate FROM plate_rollup"
+    ],
+    # 4: repeat offenders, first/last violation of each plate and its stations, maintained by the writer
+    [
+        "ALTER TABLE plate_rollup ADD COLUMN first_seen REAL",
+        "ALTER TABLE plate_rollup ADD COLUMN last_seen REAL",
+        "CREATE TABLE IF NOT EXISTS plate_stations (plate TEXT NOT NULL, station INTEGER NOT NULL, "
+        "count INTEGER NOT NULL, PRIMARY KEY (plate, station)) WITHOUT ROWID",
+        # the monthly partitions too, when they exist (see ViolationPartitions)
+        "CREATE VIEW IF NOT EXISTS violations_history AS SELECT id, plate, date, station, ts FROM violations",
+        "UPDATE plate_rollup SET first_seen = seen.first, last_seen = seen.last FROM "
+        "(SELECT plate, MIN(COALESCE(ts, CAST(date AS REAL))) AS first, MAX(COALESCE(ts, CAST(date AS REAL))) AS last "
+        "FROM violations_history GROUP BY plate) AS seen WHERE plate_rollup.plate = seen.plate",
+        "INSERT INTO plate_stations (plate, station, count) "
+        "SELECT plate, station, COUNT(*) FROM violations_history GROUP BY plate, station"
+    ]
+]
+
+# rollups updated with the violations inserted after a given id (buckets are UTC hours and days)
+# NOT INDEXED keeps the rowid range: otherwise the GROUP BY makes SQLite scan a whole covering index
+ROLLUP_UPDATES = [
+    '''INSERT INTO violations_hourly (station, hour, count)
+       SELECT station, CAST(ts / 3600 AS INTEGER) * 3600, COUNT(*) FROM violations NOT INDEXED WHERE id > ? GROUP BY 1, 2
+       ON CONFLICT(station, hour) DO UPDATE SET count = count + excluded.count''',
+    '''INSERT INTO violations_daily (station, day, count)
+       SELECT station, CAST(ts / 86400 AS INTEGER) * 86400, COUNT(*) FROM violations NOT INDEXED WHERE id > ? GROUP BY 1, 2
+       ON CONFLICT(station, day) DO UPDATE SET count = count + excluded.count''',
+    '''INSERT INTO plate_rollup (plate, count, first_seen, last_seen)
+       SELECT plate, COUNT(*), MIN(ts), MAX(ts) FROM violations NOT INDEXED WHERE id > ? GROUP BY plate
+       ON CONFLICT(plate) DO UPDATE SET count = count + excluded.count,
+       first_seen = MIN(COALESCE(first_seen, excluded.first_seen), excluded.first_seen),
+       last_seen = MAX(COALESCE(last_seen, excluded.last_seen), excluded.last_seen)''',
+    '''INSERT INTO plate_stations (plate, station, count)
+       SELECT plate, station, COUNT(*) FROM violations NOT INDEXED WHERE id > ? GROUP BY plate, station
+       ON CONFLICT(plate, station) DO UPDATE SET count = count + excluded.count''',
+    '''WITH RECURSIVE positions(plate, i) AS (
+           SELECT DISTINCT plate, 0 FROM violations NOT INDEXED WHERE id > ?
+           UNION ALL SELECT plate, i + 1 FROM positions WHERE i < length(plate))
+       INSERT OR IGNORE INTO plate_variants (variant, plate)
+       SELECT CASE i WHEN 0 THEN plate ELSE substr(plate, 1, i - 1) || substr(plate, i + 1) END, plate FROM positions'''
+]
+
+BACKFILL_CHUNK = 1000 #rows converted in each backfill transaction
+
+# applied to every connection; journal_mode=WAL is stored in the database file itself
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous=NORMAL", #with WAL a commit is still atomic, only the fsync of each commit is skipped
+    "PRAGMA cache_size=-16000", #16 MB page cache per connection
+    "PRAGMA mmap_size=268435456", #reads served from a 256 MB memory map
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000" #wait for the writer instead of failing with "database is locked"
+]
+EXPORT_CHUNK = 1000 #rows fetched from the cursor for each chunk of an export
+
+INSERT_VIOLATION = '''
+    INSERT INTO violations (plate, date, station, ts)
+    VALUES (?, ?, ?, CAST(? AS REAL))
+'''
+
+
+def parse_violation(data):
+    """ Validates a violation and returns its row for INSERT_VIOLATION, raises ValueError if invalid. """
+    if not isinstance(data, dict):
+        raise ValueError("A violation must be a JSON object")
+    plate = data.get("plate")
+    date = data.get("date")
+    station = data.get("station")
+    if not plate or not date or station is None:
+        raise ValueError("Missing required fields: plate, date, or station")
+    return (plate, date, station, date)
+
+
+MAX_FUZZY_PLATES = 50 #closest plates searched by ?plate_fuzzy
+
+
+def parse_plate_search(params):
+    """
+    Plate filter of a query string: exact plate, plate_prefix or plate_fuzzy.
+    Returns the keyword arguments of build_query, raises ValueError if invalid.
+    """
+    given = [name for name in ('plate', 'plate_prefix', 'plate_fuzzy') if params.get(name)]
+    if len(given) > 1:
+        raise ValueError("Use only one of plate, plate_prefix and plate_fuzzy")
+    search = {"plate": params.get('plate')}
+    for name in ('plate_prefix', 'plate_fuzzy'):
+        if params.get(name):
+            value = params[name].strip().upper()
+            # a blank value would mean no filter at all, i.e. every violation
+            if not value:
+                raise ValueError(f"{name} must not be blank")
+            search[name] = value
+    return search
+
+
+def plate_variants(plate):
+    """
+    The plate and the plate without one of its characters.
+    Two plates at edit distance 1 always share a variant: the plate table stores the variants
+    of every known plate, so a fuzzy search is a few primary key lookups.
+    """
+    return {plate} | {plate[:i] + plate[i + 1:] for i in range(len(plate))}
+
+
+def edit_distance(a, b):
+    """ Levenshtein distance: substituted, missing or extra characters """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def encode_cursor(ts, row_id):
+    """ Opaque cursor of the next page: position (ts, id) of the last returned violation. """
+    return base64.urlsafe_b64encode(json.dumps([ts, row_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        ts, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def normalize_station(station):
+    # stations are stored as INTEGER, "2" in a query string and 2 in the table are the same station
+    try:
+        return int(station)
+    except (TypeError, ValueError):
+        return str(station)
+
+
+class QueryCache:
+    """
+    LRU cache of the results of GET /infraction, keyed by the normalized query
+    (plate, station, from, to, cursor position, limit)
+    entries are indexed by plate, by station and by the days their date range covers, so an
+    insert only invalidates the entries whose filters match the new violation
+    """
+
+    BUCKET = 86400 #day buckets of the entries filtered only by date range
+    MAX_BUCKETS = 62 #longer ranges are checked against every insert
+    RECENT_ROWS = 10000 #inserted rows remembered to validate the results computed meanwhile
+
+    def __init__(self, max_entries=1024, max_rows=1000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows #larger results are not cached
+        self.entries = OrderedDict() #key -> result rows, least recently used first
+        self.by_plate = {}
+        self.by_station = {}
+        self.by_bucket = {}
+        self.unbounded = set()
+        self.lock = threading.Lock()
+
+        # sequence number of the last inserted row and the last inserted rows (seq, plate, station, ts)
+        self.seq = 0
+        self.recent = deque(maxlen=self.RECENT_ROWS)
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(plate, station, from_date, to_date, after, limit):
+        start = end = None
+        if from_date and to_date:
+            try:
+                start, end = float(from_date), float(to_date)
+            except ValueError:
+                pass #ignored by build_query too
+        return (plate or None, normalize_station(station) if station else None, start, end, after, limit)
+
+    @staticmethod
+    def matches(key, plate, station, ts):
+        key_plate, key_station, start, end = key[:4]
+        return ((key_plate is None or key_plate == plate)
+                and (key_station is None or key_station == station)
+                and (start is None or start <= ts <= end))
+
+    def index_sets(self, key):
+        plate, station, start, end = key[:4]
+        if plate is not None:
+            return [self.by_plate.setdefault(plate, set())]
+        if station is not None:
+            return [self.by_station.setdefault(station, set())]
+        if start is not None and 0 <= (end - start) / self.BUCKET <= self.MAX_BUCKETS:
+            return [self.by_bucket.setdefault(bucket, set())
+                    for bucket in range(int(start // self.BUCKET), int(end // self.BUCKET) + 1)]
+        return [self.unbounded]
+
+    def remove(self, key):
+        del self.entries[key]
+        for keys in self.index_sets(key):
+            keys.discard(key)
+        # drop the empty sets, plates are unbounded
+        plate, station = key[:2]
+        if plate is not None and not self.by_plate.get(plate):
+            self.by_plate.pop(plate, None)
+        if station is not None and not self.by_station.get(station):
+            self.by_station.pop(station, None)
+
+    def get(self, key):
+        """ Returns the cached rows and the current sequence number (needed by put) """
+        with self.lock:
+            rows = self.entries.get(key)
+            if rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return rows, self.seq
+
+    def put(self, key, rows, seq):
+        """ Caches the rows read when the sequence number was seq, unless an insert made them stale meanwhile """
+        if len(rows) > self.max_rows:
+            return
+        with self.lock:
+            if seq != self.seq:
+                if not self.recent or self.recent[0][0] > seq + 1:
+                    return #the rows inserted meanwhile are not all remembered
+                for row_seq, plate, station, ts in self.recent:
+                    if row_seq > seq and self.matches(key, plate, station, ts):
+                        return
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = rows
+            for keys in self.index_sets(key):
+                keys.add(key)
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, rows):
+        """ Called after an insert commit with the new (plate, station, ts) """
+        with self.lock:
+            for plate, station, ts in rows:
+                station = normalize_station(station)
+                self.seq += 1
+                self.recent.append((self.seq, plate, station, ts))
+                if not self.entries:
+                    continue
+                candidates = set(self.by_plate.get(plate, ()))
+                candidates.update(self.by_station.get(station, ()))
+                if ts is not None:
+                    candidates.update(self.by_bucket.get(int(ts // self.BUCKET), ()))
+                candidates.update(self.unbounded)
+                for key in candidates:
+                    if key in self.entries and self.matches(key, plate, station, ts):
+                        self.remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_plate.clear()
+            self.by_station.clear()
+            self.by_bucket.clear()
+            self.unbounded.clear()
+            self.seq += 1 #results computed before the clear are not cached
+            self.recent.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "maxEntries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses,
+                    "hitRatio": round(self.hits / lookups, 3) if lookups else None,
+                    "invalidations": self.invalidations, "evictions": self.evictions}
+
+
+class PlateBloomFilter:
+    """
+    Set of the plates ever seen, without false negatives: "not seen" is certain,
+    "seen" is wrong with probability error_rate while at most capacity plates are added.
+    Answers exact plate searches of unknown plates without touching the database.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.additions = 0
+        self.ready = False #until the known plates are loaded every plate may have been seen
+
+    def positions(self, plate):
+        # double hashing: the k positions come from two 64 bit halves of one digest
+        digest = hashlib.blake2b(plate.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, plate):
+        for position in self.positions(plate):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.additions += 1
+
+    def might_contain(self, plate):
+        if not self.ready:
+            return True
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(plate))
+
+    def stats(self):
+        return {"ready": self.ready, "additions": self.additions, "bits": self.size, "hashes": self.hashes}
+
+
+class PendingWrite:
+    """ Rows queued by a request thread, done is set once they are committed (or failed). """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+
+
+class ViolationWriter:
+    """
+    Single writer thread with group commit: the violations queued by the request threads
+    within max_latency_ms (or until max_batch rows) are inserted in one transaction,
+    so a burst of POSTs costs one fsync instead of one per violation.
+    The writer connection uses synchronous=FULL: a write is acknowledged only once it is on disk.
+    """
+
+    def __init__(self, get_connection, max_latency_ms=10, max_batch=500, on_commit=None):
+        self.get_connection = get_connection
+        self.on_commit = on_commit #called with the (plate, station, ts) of the committed rows
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="violation_writer", daemon=True)
+
+        # statistics
+        self.commits = 0
+        self.rows_written = 0
+
+    def start(self):
+        self.thread.start()
+
+    def write(self, rows, timeout=30):
+        """ Queues the rows and waits until they are committed, raises the error of the insert if any. """
+        pending = PendingWrite(rows)
+        self.queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("The violation was not written in time")
+        if pending.error is not None:
+            raise pending.error
+
+    def run(self):
+        conn = self.get_connection()
+        conn.execute("PRAGMA synchronous=FULL")
+        while self.running or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # collect the writes arriving within max_latency, up to max_batch rows
+            rows = len(batch[0].rows)
+            deadline = time.monotonic() + self.max_latency
+            while rows < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                rows += len(pending.rows)
+            self.commit(conn, batch)
+
+    def insert(self, conn, batch):
+        """
+        Inserts the rows of the batch and updates the rollups, in the caller's transaction.
+        Returns the (plate, station, ts) of the inserted rows, as stored.
+        """
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM violations").fetchone()[0]
+        for pending in batch:
+            conn.executemany(INSERT_VIOLATION, pending.rows)
+        # the new rows are a rowid range, aggregated without scanning the table
+        for statement in ROLLUP_UPDATES:
+            conn.execute(statement, (last_id,))
+        if self.on_commit is None:
+            return []
+        return conn.execute("SELECT plate, station, ts FROM violations WHERE id > ?", (last_id,)).fetchall()
+
+    def committed(self, inserted):
+        # before the acknowledgement, so a client reading after its POST sees the new violation
+        if self.on_commit is not None:
+            try:
+                self.on_commit(inserted)
+            except Exception as e:
+                print(f"Commit callback error: {e}")
+
+    def commit(self, conn, batch):
+        try:
+            with conn:
+                inserted = self.insert(conn, batch)
+        except Exception:
+            # the transaction was rolled back, retry each write alone so one bad write does not fail the others
+            for pending in batch:
+                try:
+                    with conn:
+                        inserted = self.insert(conn, [pending])
+                    self.committed(inserted)
+                    self.commits += 1
+                    self.rows_written += len(pending.rows)
+                except Exception as e:
+                    pending.error = e
+                pending.done.set()
+            return
+        self.committed(inserted)
+        self.commits += 1
+        self.rows_written += sum(len(pending.rows) for pending in batch)
+        for pending in batch:
+            pending.done.set()
+
+    def stop(self):
+        """ Writes the queued violations and stops the thread. """
+        self.running = False
+        self.thread.join(timeout=5)
+
+
+def random_plate():
+    """ Fake license plate, like the violation detector: the infraction sensors do not read plates """
+    letters = lambda: ''.join(random.choices(string.ascii_uppercase, k=2))
+    numbers = lambda: ''.join(random.choices(string.digits, k=3))
+    return f"{letters()}{numbers()}{letters()}"
+
+
+class ViolationConsumer:
+    """
+    Optional MQTT ingestion of the infractions published by the sensors.
+    Messages are validated like POST /infraction and written through the group commit writer,
+    without the two HTTP round trips of the violation detector.
+    Backpressure: the messages wait in a bounded queue; when it is full the MQTT callback blocks,
+    paho stops reading from the broker and, with QoS 2, the broker holds the messages not acknowledged.
+    The queued violations are written before the adaptor stops.
+    """
+
+    def __init__(self, writer, client_id, broker, port, topic, queue_size=1000, max_batch=500):
+        self.writer = writer
+        self.topic = topic
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.client = MyMQTT(client_id, broker, port, self)
+        self.running = False
+        self.thread = threading.Thread(target=self.run, name="violation_consumer", daemon=True)
+
+        # statistics
+        self.received = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        threading.Thread(target=self.connect, name="violation_consumer_connect", daemon=True).start()
+
+    def connect(self):
+        try:
+            self.client.start()
+            time.sleep(1)
+            self.client.mySubscribe(self.topic)
+        except Exception as e:
+            print(f"MQTT ingestion error: {e}")
+
+    def notify(self, topic, payload):
+        """ Called by the MQTT client for every message, blocks while the queue is full """
+        self.received += 1
+        try:
+            message = json.loads(payload.decode())
+            # the sensors publish {"timestamp", "station"}, a full violation is accepted as well
+            row = parse_violation({"plate": message.get("plate") or random_plate(),
+                                   "date": message.get("date", message.get("timestamp")),
+                                   "station": message.get("station")})
+        except (ValueError, AttributeError) as e:
+            self.rejected += 1
+            print(f"Invalid violation on topic '{topic}': {e}")
+            return
+        self.queue.put(row)
+
+    def run(self):
+        while self.running or not self.queue.empty():
+            try:
+                rows = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(rows) < self.max_batch:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.writer.write(rows)
+                self.written += len(rows)
+            except Exception as e:
+                self.failed += len(rows)
+                print(f"MQTT ingestion write failed: {e}")
+
+    def stop(self):
+        """ Stops receiving, then writes the queued violations """
+        try:
+            self.client.stop()
+        except Exception as e:
+            print(f"MQTT ingestion error: {e}")
+        self.running = False
+        self.thread.join(timeout=30)
+
+    def stats(self):
+        return {"topic": self.topic, "received": self.received, "rejected": self.rejected,
+                "written": self.written, "failed": self.failed,
+                "queued": self.queue.qsize(), "queueSize": self.queue.maxsize}
+
+
+def month_start(ts, months_offset=0):
+    """ Unix time of the start of the UTC month of ts, moved by months_offset months """
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    month = dt.year * 12 + dt.month - 1 + months_offset
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+
+
+def partition_name(ts):
+    dt = datetime.fromtimestamp(month_start(ts), timezone.utc)
+    return f"violations_{dt.year:04d}_{dt.month:02d}"
+
+
+def partition_bounds(name):
+    # [start, end) of the month stored in the partition violations_YYYY_MM
+    year, month = int(name[-7:-3]), int(name[-2:])
+    start = datetime(year, month, 1, tzinfo=timezone.utc).timestamp()
+    return start, month_start(start, 1)
+
+
+class ViolationPartitions:
+    """
+    Time partitioning of the violations.
+    The violations table keeps the recent (hot) months: inserts and queries on recent dates only
+    touch it, whatever the size of the history. A background thread moves the older months in
+    monthly tables violations_YYYY_MM (same columns and indexes, ids preserved) and the
+    violations_history view is the union of the hot table and of all the partitions.
+    Invariant: every violation with ts >= hot_start is in the hot table, so a query starting
+    after hot_start reads only the hot table, the others read the view.
+    Partitions older than retention_months are appended to a gzip NDJSON file in archive_dir and
+    dropped, then the free pages are returned to the file system with incremental vacuum.
+    The rollups keep counting the archived violations.
+    """
+
+    PARTITION_GLOB = "violations_[0-9][0-9][0-9][0-9]_[0-9][0-9]"
+    VIEW = "violations_history"
+    COLUMNS = "id, plate, date, station, ts"
+
+    def __init__(self, adaptor, hot_months=3, retention_months=0, archive_dir="archive",
+                 interval_s=3600, chunk=5000):
+        self.adaptor = adaptor
+        self.hot_months = max(hot_months, 1)
+        # 0 keeps the history forever, otherwise at least the hot months are kept
+        self.retention_months = max(retention_months, self.hot_months) if retention_months else 0
+        self.archive_dir = archive_dir
+        self.interval = interval_s
+        self.chunk = chunk
+        self.hot_start = None #None: no partition, everything is in the hot table
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="violation_partitions", daemon=True)
+
+        # statistics
+        self.moved_rows = 0
+        self.archived_rows = 0
+        self.vacuumed_pages = 0
+        self.vacuum_skipped = False #logged once
+
+        with self.adaptor.get_connection() as conn:
+            self.refresh(conn)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=5)
+
+    def partitions(self, conn):
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                            (self.PARTITION_GLOB,)).fetchall()
+        return sorted(name for name, in rows)
+
+    def refresh(self, conn, drop=None):
+        """ Recreates the union view and recomputes hot_start after the partitions changed, drop is a partition to drop """
+        partitions = [name for name in self.partitions(conn) if name != drop]
+        selects = [f"SELECT {self.COLUMNS} FROM violations"]
+        selects += [f"SELECT {self.COLUMNS} FROM {name}" for name in partitions]
+        # sqlite3 does not open a transaction before DDL statements: without an explicit one each
+        # statement commits alone and readers could find the view missing or on a dropped table
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if drop is not None:
+                conn.execute(f"DROP TABLE {drop}")
+            conn.execute(f"DROP VIEW IF EXISTS {self.VIEW}")
+            conn.execute(f"CREATE VIEW {self.VIEW} AS " + " UNION ALL ".join(selects))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.hot_start = max(partition_bounds(name)[1] for name in partitions) if partitions else None
+
+    def table_for(self, start):
+        """ Table to query for violations with ts >= start (None: no lower bound) """
+        if self.hot_start is None or (start is not None and start >= self.hot_start):
+            return "violations"
+        return self.VIEW
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if not self.adaptor.ts_ready:
+                continue #months are known only once every row has its ts
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"Partition maintenance error: {e}")
+
+    def maintain(self):
+        conn = self.adaptor.get_connection()
+        self.move_old_months(conn)
+        if self.retention_months:
+            self.apply_retention(conn)
+        self.vacuum(conn)
+
+    def create_partition(self, conn, name):
+        # same declaration of the hot table (the type of date differs between deployments),
+        # ids keep increasing after a move thanks to its AUTOINCREMENT
+        schema = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'violations'").fetchone()[0]
+        schema = re.sub(r"^CREATE TABLE\s+\"?violations\"?", f"CREATE TABLE IF NOT EXISTS {name}", schema)
+        with conn:
+            conn.execute(schema)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_plate_ts ON {name}(plate, ts)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_station_ts ON {name}(station, ts)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_ts ON {name}(ts)")
+        # hot_start moves after the month before any row leaves the hot table
+        self.refresh(conn)
+
+    def move_old_months(self, conn):
+        boundary = month_start(time.time(), -self.hot_months + 1)
+        while not self.stop_event.is_set():
+            oldest = conn.execute("SELECT MIN(ts) FROM violations").fetchone()[0]
+            if oldest is None or oldest >= boundary:
+                return
+            name = partition_name(oldest)
+            start, end = partition_bounds(name)
+            self.create_partition(conn, name)
+            # small transactions, the writer is blocked only for one chunk at a time
+            while not self.stop_event.is_set():
+                with conn:
+                    rows = conn.execute(f"SELECT {self.COLUMNS} FROM violations WHERE ts >= ? AND ts < ? LIMIT ?",
+                                        (start, end, self.chunk)).fetchall()
+                    conn.executemany(f"INSERT INTO {name} ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?)", rows)
+                    conn.executemany("DELETE FROM violations WHERE id = ?", [(row[0],) for row in rows])
+                self.moved_rows += len(rows)
+                if len(rows) < self.chunk:
+                    break
+                time.sleep(0.05)
+            print(f"Moved the violations of {name[11:]} out of the hot table")
+
+    def apply_retention(self, conn):
+        cutoff = month_start(time.time(), -self.retention_months + 1)
+        for name in self.partitions(conn):
+            if partition_bounds(name)[1] > cutoff or self.stop_event.is_set():
+                continue
+            archived = self.archive(conn, name)
+            self.refresh(conn, drop=name)
+            # archived violations disappear from the results
+            self.adaptor.cache.clear()
+            self.archived_rows += archived
+            print(f"Archived {archived} violations of {name[11:]}")
+
+    def archive(self, conn, name):
+        """ Appends the partition to archive_dir/<name>.ndjson.gz (a new gzip member) and syncs it """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.ndjson.gz")
+        count = 0
+        cursor = conn.execute(f"SELECT {self.COLUMNS} FROM {name} ORDER BY ts, id")
+        try:
+            with open(path, "ab") as raw, gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+                while True:
+                    rows = cursor.fetchmany(EXPORT_CHUNK)
+                    if not rows:
+                        break
+                    archive.write("".join(json.dumps({"id": row[0], "plate": row[1], "date": row[2], "station": row[3]}) + "\n"
+                                          for row in rows).encode("utf-8"))
+                    count += len(rows)
+                archive.close()
+                raw.flush()
+                os.fsync(raw.fileno())
+        finally:
+            cursor.close()
+        return count
+
+    def vacuum(self, conn, pages=1000):
+        """ Returns the free pages to the file system, pages at a time """
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # a database created before auto_vacuum=INCREMENTAL needs a full VACUUM, which rewrites
+            # the file holding the write lock: it is left to an offline run (see the README)
+            if not self.vacuum_skipped:
+                print(f"{free} free pages not reclaimed: auto_vacuum is not INCREMENTAL on this database")
+                self.vacuum_skipped = True
+            return
+        while free and not self.stop_event.is_set():
+            conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            self.vacuumed_pages += free - remaining
+            free = remaining
+            time.sleep(0.05)
+
+    def stats(self):
+        with self.adaptor.get_connection() as conn:
+            partitions = self.partitions(conn)
+            incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        return {"hotStart": self.hot_start, "hotMonths": self.hot_months,
+                "retentionMonths": self.retention_months, "partitions": partitions,
+                "movedRows": self.moved_rows, "archivedRows": self.archived_rows,
+                "vacuumedPages": self.vacuumed_pages, "incrementalVacuum": incremental}
+
+
+class ViolationOffenders:
+    """
+    GET /infraction/offenders: repeat offenders, read from the per-plate summary maintained by the writer
+        min_count    plates with at least min_count violations (default 2)
+        since        and a violation after this unix timestamp
+        limit        most frequent offenders first, at most MAX_LIMIT
+        plate        summary of one plate, a plate never seen is answered by the Bloom filter
+    Counts include the archived violations.
+    """
+    exposed = True
+
+    MAX_LIMIT = 1000
+
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
+    def GET(self, **kwargs):
+        params = {k: v[0] for k, v in parse_qs(cherrypy.request.query_string).items()}
+        try:
+            if params.get('plate'):
+                return self.plate_summary(params['plate'])
+            min_count = int(params.get('min_count', 2))
+            limit = min(int(params.get('limit', 100)), self.MAX_LIMIT)
+            since = float(params['since']) if 'since' in params else None
+            if min_count < 1 or limit < 1:
+                raise ValueError("min_count and limit must be positive")
+        except ValueError as e:
+            cherrypy.response.status = 400
+            return {"error": str(e)}
+
+        # the count index gives the threshold and the order, only the returned plates are read
+        query = "SELECT plate, count, first_seen, last_seen FROM plate_rollup WHERE count >= ?"
+        query_params = [min_count]
+        if since is not None:
+            query += " AND last_seen >= ?"
+            query_params.append(since)
+        query += " ORDER BY count DESC LIMIT ?"
+        query_params.append(limit)
+        with self.adaptor.get_connection() as conn:
+            rows = conn.execute(query, query_params).fetchall()
+            stations = self.stations(conn, [row[0] for row in rows])
+        return [self.summary(row, stations.get(row[0], {})) for row in rows]
+
+    def plate_summary(self, plate):
+        if not self.adaptor.seen_plates.might_contain(plate):
+            return {"plate": plate, "count": 0}
+        with self.adaptor.get_connection() as conn:
+            row = conn.execute("SELECT plate, count, first_seen, last_seen FROM plate_rollup WHERE plate = ?",
+                               (plate,)).fetchone()
+            if row is None:
+                return {"plate": plate, "count": 0} #false positive of the Bloom filter
+            return self.summary(row, self.stations(conn, [plate]).get(plate, {}))
+
+    def stations(self, conn, plates):
+        # plate -> {station: count}
+        stations = {}
+        if plates:
+            rows = conn.execute(f"SELECT plate, station, count FROM plate_stations WHERE plate IN "
+                                f"({', '.join('?' * len(plates))})", plates)
+            for plate, station, count in rows:
+                stations.setdefault(plate, {})[station] = count
+        return stations
+
+    @staticmethod
+    def summary(row, stations):
+        plate, count, first_seen, last_seen = row
+        return {"plate": plate, "count": count, "firstSeen": first_seen, "lastSeen": last_seen, "stations": stations}
+
+
+class ViolationExport:
+    """
+    GET /infraction/export?format=ndjson|csv[&gzip=true] with the same filters of GET /infraction
+    the rows are read from the cursor EXPORT_CHUNK at a time and streamed while they are read,
+    so the memory used does not depend on the size of the export
+    """
+    exposed = True
+    _cp_config = {
+        'response.stream': True,
+        'tools.json_out.on': False,
+        'tools.response_headers.on': False
+    }
+
+    FORMATS = {
+        "ndjson": ("application/x-ndjson", "ndjson"),
+        "csv": ("text/csv", "csv")
+    }
+
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
+    def GET(self, **kwargs):
+        params = {k: v[0] for k, v in parse_qs(cherrypy.request.query_string).items()}
+        export_format = params.get('format', 'ndjson').lower()
+        if export_format not in self.FORMATS:
+            raise cherrypy.HTTPError(400, "format must be ndjson or csv")
+        compress = params.get('gzip', 'false').lower() in ('true', '1', 'yes')
+
+        try:
+            plate_search = parse_plate_search(params)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        query, query_params = self.adaptor.build_query(station=params.get('station'), from_date=params.get('from'),
+                                                       to_date=params.get('to'), **plate_search)
+
+        content_type, extension = self.FORMATS[export_format]
+        filename = f"violations.{extension}"
+        if compress:
+            content_type = "application/gzip"
+            filename += ".gz"
+        cherrypy.response.headers['Content-Type'] = content_type
+        cherrypy.response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return self.stream(query, query_params, export_format, compress)
+
+    def stream(self, query, query_params, export_format, compress):
+        # runs in the request thread while the response is sent, so it uses the thread connection
+        gzip = zlib.compressobj(wbits=31) if compress else None #wbits=31: gzip container
+        cursor = self.adaptor.get_connection().execute(query, query_params)
+        try:
+            if export_format == "csv":
+                yield self.encode("id,plate,date,station\r\n", gzip)
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                if export_format == "csv":
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(row[:4] for row in rows)
+                    chunk = buffer.getvalue()
+                else:
+                    chunk = "".join(json.dumps({"id": row[0], "plate": row[1], "date": row[2], "station": row[3]}) + "\n"
+                                    for row in rows)
+                data = self.encode(chunk, gzip)
+                if data:
+                    yield data
+            if gzip is not None:
+                yield gzip.flush()
+        finally:
+            # also when the client disconnects, an open cursor would keep its read transaction
+            cursor.close()
+
+    def encode(self, text, gzip):
+        data = text.encode("utf-8")
+        return gzip.compress(data) if gzip is not None else data
+
+
+class ViolationStats:
+    """
+    GET /infraction/stats/<view>, answered from the rollup tables:
+        hourly, daily    counts per time bucket (UTC), optionally of one station
+        stations         per-station histogram
+        top_plates       plates with most violations (all time)
+        cache            hit/miss counters of the query cache
+        storage          partitions, moved and archived violations
+        ingest           counters of the MQTT ingestion
+    from/to (unix timestamps) restrict hourly, daily and stations to the buckets in the range
+    """
+    exposed = True
+
+    MAX_TOP = 1000
+
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
+    def GET(self, *uri, **kwargs):
+        params = {k: v[0] for k, v in parse_qs(cherrypy.request.query_string).items()}
+        view = uri[0] if uri else None
+        try:
+            start = float(params.get('from', 0))
+            end = float(params.get('to', 2 ** 62))
+            if view in ('hourly', 'daily'):
+                return self.buckets(view, start, end, params.get('station'))
+            if view == 'stations':
+                return self.stations(start, end, 'from' in params or 'to' in params)
+            if view == 'cache':
+                return dict(self.adaptor.cache.stats(), seenPlates=self.adaptor.seen_plates.stats())
+            if view == 'storage':
+                return self.adaptor.partitions.stats()
+            if view == 'ingest':
+                if self.adaptor.consumer is None:
+                    return {"enabled": False}
+                return dict(self.adaptor.consumer.stats(), enabled=True)
+            if view == 'top_plates':
+                n = int(params.get('n', 10))
+                if n < 1:
+                    raise ValueError("n must be positive")
+                return self.top_plates(min(n, self.MAX_TOP))
+        except ValueError as e:
+            cherrypy.response.status = 400
+            return {"error": str(e)}
+        cherrypy.response.status = 404
+        return {"error": "Unknown statistic, use hourly, daily, stations, top_plates, cache, storage or ingest"}
+
+    def buckets(self, view, start, end, station=None):
+        table, column, size = ("violations_hourly", "hour", 3600) if view == 'hourly' else ("violations_daily", "day", 86400)
+        # the bucket containing start is included
+        query = f"SELECT {column}, SUM(count) FROM {table} WHERE {column} BETWEEN ? AND ?"
+        params = [start - start % size, end]
+        if station:
+            query += " AND station = ?"
+            params.append(station)
+        query += f" GROUP BY {column} ORDER BY {column}"
+        with self.adaptor.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [{"bucket": bucket, "count": count} for bucket, count in rows]
+
+    def stations(self, start, end, ranged):
+        # the hourly rollup gives finer ranges, the daily one has fewer rows to sum
+        if ranged:
+            table, column, size = "violations_hourly", "hour", 3600
+        else:
+            table, column, size = "violations_daily", "day", 86400
+        with self.adaptor.get_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT station, SUM(count) FROM {table} WHERE {column} BETWEEN ? AND ?
+                GROUP BY station ORDER BY station
+            ''', (start - start % size, end)).fetchall()
+        return [{"station": station, "count": count} for station, count in rows]
+
+    def top_plates(self, n):
+        with self.adaptor.get_connection() as conn:
+            rows = conn.execute("SELECT plate, count FROM plate_rollup ORDER BY count DESC LIMIT ?", (n,)).fetchall()
+        return [{"plate": plate, "count": count} for plate, count in rows]
+
+
+class ViolationBatch:
+    """ POST /infraction/batch: an array of violations, written in a single transaction. """
+    exposed = True
+
+    def __init__(self, adaptor):
+        self.adaptor = adaptor
+
+    def POST(self):
+        try:
+            data = json.loads(cherrypy.request.body.read().decode("utf-8"))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            cherrypy.response.status = 400
+            return {"error": "Invalid JSON format"}
+
+        if not isinstance(data, list) or not data:
+            cherrypy.response.status = 400
+            return {"error": "The body must be a non-empty array of violations"}
+        if len(data) > self.adaptor.max_batch_request:
+            cherrypy.response.status = 413
+            return {"error": f"At most {self.adaptor.max_batch_request} violations per batch"}
+
+        # the batch is all or nothing, invalid items are reported with their index
+        rows = []
+        errors = []
+        for index, item in enumerate(data):
+            try:
+                rows.append(parse_violation(item))
+            except ValueError as e:
+                errors.append({"index": index, "error": str(e)})
+        if errors:
+            cherrypy.response.status = 400
+            return {"error": "Invalid violations", "details": errors}
+
+        try:
+            self.adaptor.writer.write(rows)
+        except Exception as e:
+            cherrypy.response.status = 500
+            return {"error": f"Internal Server Error: {e}"}
+
+        cherrypy.response.status = 201
+        return {"message": "Violations added successfully!", "inserted": len(rows)}
 
 @cherrypy.tools.json_out()
 class DatabaseAdaptor:
     exposed = True
 
     def __init__(self, resource_info_path, catalog_info_path):
+        # one persistent connection for each thread (cherrypy pool, background threads)
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
         self.init_db()
 
+        # until every row has its ts, date range queries fall back to the date column
+        self.ts_ready = not self.has_missing_ts()
+        if not self.ts_ready:
+            threading.Thread(target=self.backfill_ts, name="backfill_ts", daemon=True).start()
+
         # use absolute paths
         script_dir = os.path.dirname(os.path.abspath(__file__))
         resource_info_path = os.path.join(script_dir, resource_info_path)
@@ -26,27 +1080,96 @@ class DatabaseAdaptor:
         # load JSON files
         self.resource_info = json.load(open(resource_info_path))
         catalog_info = json.load(open(catalog_info_path))
-        self.catalog_url = f"http://{catalog_info['ip_address']}:{catalog_info['ip_port']}/registerResource"
+        self.catalog_url = f"http://{catalog_info['ip_address']}:{catalog_info['ip_port']}"
+        # full registration only when the description changes, heartbeats otherwise
+        self.catalog_client = CatalogClient(self.catalog_url, resource_info=self.resource_info)
+
+        # results of the repeated searches, invalidated by the writer when matching violations are inserted
+        config = self.resource_info.get("config", [{}])[0]
+        # plates ever seen, filled in background, then by the writer
+        self.seen_plates = self.load_seen_plates(int(config.get("bloom_capacity", 1000000)),
+                                                 float(config.get("bloom_error_rate", 0.01)))
+        self.cache = QueryCache(max_entries=int(config.get("query_cache_entries", 1024)),
+                                max_rows=int(config.get("query_cache_max_rows", 1000)))
+
+        # all the inserts go through the group commit writer
+        self.writer = ViolationWriter(self.get_connection,
+                                      max_latency_ms=float(config.get("write_max_latency_ms", 10)),
+                                      max_batch=int(config.get("write_max_batch", 500)),
+                                      on_commit=self.committed)
+        self.writer.start()
+        self.max_batch_request = int(config.get("batch_max_violations", 10000))
+        self.max_page_size = int(config.get("max_page_size", 1000)) #largest page returned with ?limit/?cursor
+        self.batch = ViolationBatch(self)
+
+        # optional direct ingestion of the sensors' infractions, instead of the violation detector's POST
+        self.consumer = None
+        if config.get("mqtt_ingest", False):
+            self.consumer = ViolationConsumer(self.writer,
+                                              client_id=config.get("mqtt_client_id", "db_connector_ingest"),
+                                              broker=catalog_info["broker"],
+                                              port=int(catalog_info["broker_port"]),
+                                              topic=config.get("mqtt_topic", "SmartTrafficLight/Led/+/redInfraction"),
+                                              queue_size=int(config.get("mqtt_queue_size", 1000)),
+                                              max_batch=int(config.get("write_max_batch", 500)))
+            self.consumer.start()
+
+        # recent months in the violations table, older ones in monthly partitions, archived after the retention
+        self.partitions = ViolationPartitions(self,
+                                              hot_months=int(config.get("hot_months", 3)),
+                                              retention_months=int(config.get("retention_months", 0)),
+                                              archive_dir=os.path.join(script_dir, config.get("archive_dir", "archive")),
+                                              interval_s=float(config.get("maintenance_interval_s", 3600)),
+                                              chunk=int(config.get("move_chunk", 5000)))
+        self.partitions.start()
+        self.export = ViolationExport(self)
+        self.stats = ViolationStats(self)
+        self.offenders = ViolationOffenders(self)
 
         # start registration thread
         threading.Thread(target=self.register_to_catalog, daemon=True).start()
 
+    def load_seen_plates(self, capacity, error_rate):
+        """ Bloom filter of the known plates, sized for at least twice the plates already stored """
+        with self.get_connection() as conn:
+            known = conn.execute("SELECT COUNT(*) FROM plate_rollup").fetchone()[0]
+        seen_plates = PlateBloomFilter(max(capacity, 2 * known), error_rate)
+
+        def load():
+            for plate, in self.get_connection().execute("SELECT plate FROM plate_rollup"):
+                seen_plates.add(plate)
+            seen_plates.ready = True
+        # plates committed meanwhile are added by committed()
+        threading.Thread(target=load, name="load_seen_plates", daemon=True).start()
+        return seen_plates
+
+    def committed(self, inserted):
+        """ Called by the writer after each commit, before the writes are acknowledged """
+        for plate, station, ts in inserted:
+            self.seen_plates.add(plate)
+        self.cache.invalidate(inserted)
+
     def register_to_catalog(self):
         """ Periodically register this service to the catalog """
         while True:
             try:
                 self.resource_info["lastUpdate"] = time.time()
                 print(f"Registering: {self.resource_info['ID']}")
-                response = requests.put(self.catalog_url, json=self.resource_info)
+                response = self.catalog_client.refresh()
                 print(f"Registered to catalog: {response.status_code} - {response.text}")
             except Exception as e:
                 print(f"Registration error: {e}")
             time.sleep(10)
 
     def init_db(self):
-        """ Initializes the database table if it does not exist. """
-        with sqlite3.connect(DB_PATH) as conn:
+        """ Initializes the database table if it does not exist and applies the pending migrations. """
+        with self.get_connection() as conn:
             cursor = conn.cursor()
+            # takes effect only on a new database, before its first table: the pages freed by the
+            # retention are then returned in background (see ViolationPartitions.vacuum)
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # readers and the writer no longer block each other
+            cursor.execute("PRAGMA journal_mode=WAL")
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS violations (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,73 +1179,205 @@ class DatabaseAdaptor:
                 )
             ''')
             conn.commit()
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                # sqlite3 does not open a transaction before DDL statements: without an explicit one a
+                # crash in the middle would leave the columns added and user_version behind, and the
+                # migration would fail on every restart ("duplicate column name")
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    for statement in statements:
+                        cursor.execute(statement)
+                    cursor.execute(f"PRAGMA user_version = {number}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                print(f"Database migrated to schema version {number}")
+
+    def has_missing_ts(self):
+        with self.get_connection() as conn:
+            # index lookup on idx_violations_ts, not a scan
+            return conn.execute("SELECT 1 FROM violations WHERE ts IS NULL LIMIT 1").fetchone() is not None
+
+    def backfill_ts(self):
+        """ Fills ts of the rows stored before the migration, in small transactions so inserts are not blocked for long. """
+        conn = self.get_connection()
+        converted = 0
+        try:
+            while True:
+                with conn:
+                    # CAST like the old queries did, a non-numeric date becomes 0
+                    cursor = conn.execute('''
+                        UPDATE violations SET ts = CAST(date AS REAL)
+                        WHERE id IN (SELECT id FROM violations WHERE ts IS NULL LIMIT ?)
+                    ''', (BACKFILL_CHUNK,))
+                if cursor.rowcount == 0:
+                    break
+                converted += cursor.rowcount
+                time.sleep(0.05) #leave room to the writers
+            self.ts_ready = True
+            print(f"Timestamp backfill completed: {converted} rows")
+        except Exception as e:
+            print(f"Timestamp backfill error: {e}")
 
     def get_connection(self):
-        return sqlite3.connect(DB_PATH, check_same_thread=False)
+        """ Returns the connection of the calling thread, opened and tuned on first use. """
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # the connection is used only by this thread, the check is off so close_connections can close it
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
+
+    def stop(self):
+        """ Called when the cherrypy engine stops: stops the ingestion and the maintenance, writes the queued violations and closes the connections. """
+        if self.consumer is not None:
+            self.consumer.stop()
+        self.partitions.stop()
+        self.writer.stop()
+        self.close_connections()
 
-    def build_query(self, plate=None, station=None, from_date=None, to_date=None):
-        query = "SELECT * FROM violations WHERE 1=1"
+    def close_connections(self):
+        """ Closes the connections of all the threads, called when the cherrypy engine stops. """
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+    def similar_plates(self, plate):
+        """ Known plates with at most one substituted, missing or extra character, the plate itself first """
+        variants = list(plate_variants(plate))
+        with self.get_connection() as conn:
+            candidates = conn.execute(f"SELECT DISTINCT plate FROM plate_variants WHERE variant IN "
+                                      f"({', '.join('?' * len(variants))})", variants).fetchall()
+        # variants also match two swapped characters, which are two edits
+        matches = sorted((edit_distance(plate, candidate), candidate) for candidate, in candidates)
+        return [candidate for distance, candidate in matches if distance <= 1][:MAX_FUZZY_PLATES]
+
+    def build_query(self, plate=None, station=None, from_date=None, to_date=None, after=None, limit=None,
+                    plate_prefix=None, plate_fuzzy=None):
+        # (plate, ts), (station, ts) and (ts) indexes give the range and the order without sorting
+        ts = "ts" if self.ts_ready else "COALESCE(ts, CAST(date AS REAL))"
+        start = end = None
+        if from_date and to_date:
+            try:
+                start, end = float(from_date), float(to_date)
+            except Exception as e:
+                print(f"[ERROR] Invalid timestamp format: {e}")
+
+        # recent dates only read the hot table, older ones the union with the partitions
+        lower = start
+        if after is not None:
+            lower = after[0] if lower is None else max(lower, after[0])
+        table = self.partitions.table_for(lower)
+        query = f"SELECT id, plate, date, station, {ts} FROM {table} WHERE 1=1"
         params = []
 
         if plate:
             query += " AND plate = ?"
             params.append(plate)
 
+        if plate_prefix:
+            # range of the (plate, ts) index: prefix <= plate < prefix with its last character incremented
+            query += " AND plate >= ? AND plate < ?"
+            params.extend([plate_prefix, plate_prefix[:-1] + chr(ord(plate_prefix[-1]) + 1)])
+
+        if plate_fuzzy:
+            plates = self.similar_plates(plate_fuzzy)
+            query += f" AND plate IN ({', '.join('?' * len(plates))})"
+            params.extend(plates)
+
         if station:
             query += " AND station = ?"
             params.append(station)
 
-        if from_date and to_date:
-            try:
-                query += " AND CAST(date AS REAL) BETWEEN ? AND ?"
-                params.extend([float(from_date), float(to_date)])
-            except Exception as e:
-                print(f"[ERROR] Invalid timestamp format: {e}")
+        if start is not None:
+            query += f" AND {ts} BETWEEN ? AND ?"
+            params.extend([start, end])
 
-        query += " ORDER BY CAST(date AS REAL) ASC"
+        if after is not None:
+            # keyset pagination: rows after the (ts, id) of the cursor, the index seeks directly there
+            query += f" AND ({ts}, id) > (?, ?)"
+            params.extend(after)
+
+        query += f" ORDER BY {ts} ASC, id ASC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
         return query, params
 
     exposed = True
 
     def GET(self, **kwargs):
         params = {k: v[0] for k, v in parse_qs(cherrypy.request.query_string).items()}
-        plate = params.get('plate')
         station = params.get('station')
         from_date = params.get('from')
         to_date = params.get('to')
 
-        query, query_params = self.build_query(plate, station, from_date, to_date)
+        # with ?limit and/or ?cursor the result is a page {"items": [...], "next": <cursor or null>},
+        # without them the whole array as before
+        paged = 'limit' in params or 'cursor' in params
+        limit = None
+        after = None
+        try:
+            plate_search = parse_plate_search(params)
+            if paged:
+                limit = params.get('limit', str(self.max_page_size))
+                if not limit.isdigit() or int(limit) < 1:
+                    raise ValueError("limit must be a positive integer")
+                limit = min(int(limit), self.max_page_size)
+                if params.get('cursor'):
+                    after = decode_cursor(params['cursor'])
+        except ValueError as e:
+            cherrypy.response.status = 400
+            return {"error": str(e)}
 
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, query_params)
-            results = cursor.fetchall()
+        # the cache is invalidated by exact plate, prefix and fuzzy searches are not cached
+        cacheable = len(plate_search) == 1
+        key = QueryCache.make_key(plate_search["plate"], station, from_date, to_date, after, limit)
+        if plate_search["plate"] and not self.seen_plates.might_contain(plate_search["plate"]):
+            results, seq = [], None #a plate never seen has no violations
+        else:
+            results, seq = self.cache.get(key) if cacheable else (None, None)
+        if results is None:
+            # one row more than the page tells if there is a next page
+            query, query_params = self.build_query(station=station, from_date=from_date, to_date=to_date, after=after,
+                                                   limit=limit + 1 if paged else None, **plate_search)
 
-        return [
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, query_params)
+                results = cursor.fetchall()
+            if cacheable:
+                self.cache.put(key, results, seq)
+
+        items = [
             {"id": row[0], "plate": row[1], "date": row[2], "station": row[3]}
-            for row in results
+            for row in results[:limit]
         ]
+        if not paged:
+            return items
+        last = results[limit - 1] if len(results) > limit else None
+        return {"items": items, "next": encode_cursor(last[4], last[0]) if last else None}
 
     def POST(self):
         try:
             raw_body = cherrypy.request.body.read().decode("utf-8")
             data = json.loads(raw_body)
 
-            plate = data.get("plate")
-            date = data.get("date")
-            station = data.get("station")
-
-            if not plate or not date or station is None:
+            try:
+                row = parse_violation(data)
+            except ValueError as e:
                 cherrypy.response.status = 400
-                return {"error": "Missing required fields: plate, date, or station"}
+                return {"error": str(e)}
 
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO violations (plate, date, station)
-                    VALUES (?, ?, ?)
-                ''', (plate, date, station))
-                conn.commit()
+            # committed together with the other violations arriving meanwhile
+            self.writer.write([row])
 
             cherrypy.response.status = 201
             return {"message": "Violation added successfully!"}
@@ -144,8 +1399,11 @@ if __name__ == '__main__':
         'server.socket_port': 8080
     })
 
+    adaptor = DatabaseAdaptor("database_adaptor_info.json", resource_catalog_info_path)
+    cherrypy.engine.subscribe('stop', adaptor.stop)
+
     cherrypy.quickstart(
-        DatabaseAdaptor("database_adaptor_info.json", resource_catalog_info_path),
+        adaptor,
         '/infraction',
         {
             '/': {
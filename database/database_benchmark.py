@@ -0,0 +1,445 @@
+'''
+load benchmark of the database adaptor
+
+runs DatabaseAdaptor in a child process on a local port, on a temporary database seeded
+with a synthetic history (--rows violations of --plates plates over the last
+--history-days days, no catalog or broker is needed), then for --duration seconds
+--clients threads send a mix of:
+    - POST /infraction (or POST /infraction/batch with --post-batch > 1)
+    - GET /infraction?plate=     plates of the history, --unknown-ratio of never seen ones
+    - GET /infraction?station=   first page of the station, --page-size violations
+    - GET /infraction?from=&to=  first page of a random --range-hours window of the history
+
+reports p50/p99 latency and throughput of each kind of request, the inserted rows/s, the
+growth of the database file (WAL included) and CPU and memory usage of the adaptor
+process read from /proc
+
+the seeded database can be kept (--keep) and reused with --db, so runs before and after
+an index or schema change start from the same history
+
+example:
+    python database_benchmark.py --rows 5000000 --duration 60 --clients 16 --json before.json
+'''
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import database_adaptor
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+SEED_CHUNK = 100000 #rows inserted in each seeding transaction
+
+
+def run_adaptor(db_path, info_path, catalog_info_path, port, thread_pool, log_path):
+    # entry point of the adaptor process, its prints go to the log file
+    import sys
+    import cherrypy
+    sys.stdout = open(log_path, 'a', buffering=1)
+    database_adaptor.DB_PATH = db_path
+
+    adaptor = database_adaptor.DatabaseAdaptor(info_path, catalog_info_path)
+    conf = {
+        '/': {
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+            'tools.response_headers.on': True,
+            'tools.response_headers.headers': [('Content-Type', 'application/json')],
+        }
+    }
+    cherrypy.tree.mount(adaptor, '/infraction', conf)
+    cherrypy.config.update({'server.socket_host': '127.0.0.1',
+                            'server.socket_port': port,
+                            'server.thread_pool': thread_pool,
+                            'engine.autoreload.on': False,
+                            'log.screen': False})
+    cherrypy.engine.subscribe('stop', adaptor.stop)
+    cherrypy.engine.signal_handler.subscribe()
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+# free_port, percentile and ProcessMonitor are copied from resource_catalog/catalog_benchmark.py
+# (ProcessMonitor reduced to CPU and memory): like MyMQTT.py and catalog_client.py, every
+# service directory keeps its own copy of the shared code so that it runs on its own,
+# a fix to them goes to both benchmarks
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+class ProcessMonitor:
+    """ CPU time and resident memory of a process, from /proc """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK')
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            # the command name may contain spaces, fields are counted after its ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks #utime + stime
+
+    def rss_bytes(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return None
+
+    def usage(self, cpu_before, elapsed):
+        cpu = self.cpu_seconds() - cpu_before
+        return {"cpuSeconds": round(cpu, 3),
+                "cpuPercent": round(100 * cpu / elapsed, 1) if elapsed > 0 else None,
+                "rssBytes": self.rss_bytes()}
+
+
+def random_plate(rng):
+    letters = lambda: ''.join(rng.choices(string.ascii_uppercase, k=2))
+    numbers = lambda: ''.join(rng.choices(string.digits, k=3))
+    return f"{letters()}{numbers()}{letters()}"
+
+
+def database_size(db_path):
+    # the WAL holds the pages not yet checkpointed into the database file
+    return sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+
+
+class AdaptorConnection:
+    """ Keep-alive HTTP connection to the adaptor, one for each client thread """
+
+    def __init__(self, port, timeout=30):
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        # returns (status, latency in ms, response body), status None on connection errors
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, '/infraction' + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None, (time.perf_counter() - start) * 1000, None
+        return response.status, (time.perf_counter() - start) * 1000, data
+
+
+class Recorder:
+    # latencies of each kind of request, merged from the client threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.inserted = 0
+
+    def add(self, latencies, errors, inserted):
+        with self.lock:
+            for name in latencies:
+                self.latencies.setdefault(name, []).extend(latencies[name])
+                self.errors[name] = self.errors.get(name, 0) + errors[name]
+            self.inserted += inserted
+
+    def summary(self, duration):
+        results = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput": round(len(latencies) / duration, 1),
+                "p50Ms": round(percentile(latencies, 50), 3) if latencies else None,
+                "p99Ms": round(percentile(latencies, 99), 3) if latencies else None,
+                "maxMs": round(latencies[-1], 3) if latencies else None
+            }
+        return results
+
+
+class DatabaseBenchmark:
+
+    def __init__(self, args):
+        self.args = args
+        self.port = args.port or free_port()
+        self.workdir = tempfile.mkdtemp(prefix="database_benchmark_")
+        self.db_path = os.path.join(self.workdir, "database.db")
+        self.info_path = os.path.join(self.workdir, "database_adaptor_info.json")
+        self.catalog_info_path = os.path.join(self.workdir, "resource_catalog_info.json")
+        self.log_path = os.path.join(self.workdir, "adaptor.log")
+        self.process = None
+        self.recorder = Recorder()
+        self.stop_event = threading.Event()
+        self.rng = random.Random(args.seed)
+        self.plates = [random_plate(self.rng) for _ in range(args.plates)]
+
+    def prepare(self):
+        # configuration of the real adaptor, the catalog is never reachable (registration errors in the log)
+        with open(os.path.join(script_dir, "database_adaptor_info.json")) as f:
+            info = json.load(f)
+        config = info.setdefault("config", [{}])[0]
+        config["write_max_latency_ms"] = self.args.write_max_latency_ms
+        config["write_max_batch"] = self.args.write_max_batch
+        config["query_cache_entries"] = self.args.cache_entries
+        config["mqtt_ingest"] = False
+        config["maintenance_interval_s"] = 10 ** 9 #no partition move during the run
+        with open(self.info_path, 'w') as f:
+            json.dump(info, f, indent=4)
+        with open(self.catalog_info_path, 'w') as f:
+            json.dump({"ip_address": "127.0.0.1", "ip_port": str(free_port()),
+                       "broker": "localhost", "broker_port": 1883}, f, indent=4)
+
+    def start_adaptor(self):
+        self.process = multiprocessing.Process(target=run_adaptor, name="database_adaptor",
+                                               args=(self.db_path, self.info_path, self.catalog_info_path,
+                                                     self.port, self.args.thread_pool, self.log_path))
+        self.process.start()
+        # ready once the plates of the history are loaded in the Bloom filter
+        connection = AdaptorConnection(self.port, timeout=1)
+        deadline = time.time() + 600
+        while time.time() < deadline:
+            status, _, data = connection.request('GET', '/stats/cache')
+            if status == 200 and json.loads(data).get("seenPlates", {}).get("ready"):
+                return
+            if not self.process.is_alive():
+                break
+            time.sleep(0.2)
+        raise RuntimeError(f"the adaptor did not start, see {self.log_path}")
+
+    def stop_adaptor(self):
+        if self.process is None:
+            return
+        os.kill(self.process.pid, signal.SIGTERM) #the adaptor writes the queued violations on stop
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
+
+    def seed(self):
+        '''
+        creates the schema with a first start of the adaptor, then inserts the synthetic
+        history directly, with the statements of the writer, SEED_CHUNK rows per transaction
+        '''
+        self.start_adaptor()
+        self.stop_adaptor()
+        start = time.time()
+        now = time.time()
+        first = now - self.args.history_days * 86400
+        step = (now - first) / max(self.args.rows, 1)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for offset in range(0, self.args.rows, SEED_CHUNK):
+                count = min(SEED_CHUNK, self.args.rows - offset)
+                rows = []
+                for i in range(offset, offset + count):
+                    ts = first + (i + self.rng.random()) * step #increasing with the id, as if posted live
+                    rows.append((self.rng.choice(self.plates), ts, self.rng.randint(1, self.args.stations), ts))
+                with conn:
+                    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM violations").fetchone()[0]
+                    conn.executemany(database_adaptor.INSERT_VIOLATION, rows)
+                    for statement in database_adaptor.ROLLUP_UPDATES:
+                        conn.execute(statement, (last_id,))
+                print(f"Seeded {offset + count}/{self.args.rows} violations", end='\r')
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        print()
+        return round(time.time() - start, 3)
+
+    def next_request(self):
+        # (name, method, path, body, inserted rows) of a random request of the mix
+        args = self.args
+        draw = self.rng.random()
+        if draw < args.post_ratio:
+            violations = [{"plate": self.rng.choice(self.plates), "date": time.time(),
+                           "station": self.rng.randint(1, args.stations)} for _ in range(args.post_batch)]
+            if args.post_batch > 1:
+                return 'postBatch', 'POST', '/batch', violations, len(violations)
+            return 'post', 'POST', '/', violations[0], 1
+        draw -= args.post_ratio
+        if draw < args.plate_ratio:
+            known = self.rng.random() >= args.unknown_ratio
+            plate = self.rng.choice(self.plates) if known else random_plate(self.rng) + 'X'
+            return 'getPlate', 'GET', '/?' + urlencode({"plate": plate}), None, 0
+        draw -= args.plate_ratio
+        if draw < args.station_ratio:
+            query = {"station": self.rng.randint(1, args.stations), "limit": args.page_size}
+            return 'getStation', 'GET', '/?' + urlencode(query), None, 0
+        span = args.range_hours * 3600
+        start = time.time() - self.rng.uniform(span, args.history_days * 86400)
+        query = {"from": start, "to": start + span, "limit": args.page_size}
+        return 'getRange', 'GET', '/?' + urlencode(query), None, 0
+
+    def client(self):
+        connection = AdaptorConnection(self.port)
+        latencies = {}
+        errors = {}
+        inserted = 0
+        period = 1.0 / self.args.rate if self.args.rate > 0 else 0
+        next_request = time.time()
+        while not self.stop_event.is_set():
+            name, method, path, body, rows = self.next_request()
+            status, latency, _ = connection.request(method, path, body)
+            latencies.setdefault(name, []).append(latency)
+            errors.setdefault(name, 0)
+            if status in (200, 201):
+                inserted += rows
+            else:
+                errors[name] += 1
+            if period:
+                next_request += period
+                delay = next_request - time.time()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+        self.recorder.add(latencies, errors, inserted)
+
+    def adaptor_stats(self):
+        connection = AdaptorConnection(self.port)
+        stats = {}
+        for view in ('cache', 'storage'):
+            status, _, data = connection.request('GET', f'/stats/{view}')
+            stats[view] = json.loads(data) if status == 200 else None
+        return stats
+
+    def run(self):
+        self.prepare()
+        try:
+            if self.args.db:
+                shutil.copy(self.args.db, self.db_path)
+                seed_seconds = None
+                print(f"Using the history of {self.args.db}")
+            else:
+                seed_seconds = self.seed()
+                print(f"Seeded {self.args.rows} violations in {seed_seconds} s")
+            size_seeded = database_size(self.db_path)
+
+            start = time.time()
+            self.start_adaptor()
+            startup = round(time.time() - start, 3)
+            monitor = ProcessMonitor(self.process.pid)
+
+            threads = [threading.Thread(target=self.client) for _ in range(self.args.clients)]
+            cpu_before = monitor.cpu_seconds()
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            print(f"Running for {self.args.duration} s...")
+            time.sleep(self.args.duration)
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+            process = monitor.usage(cpu_before, duration)
+            size_run = database_size(self.db_path)
+            stats = self.adaptor_stats()
+            self.stop_adaptor() #the last connection checkpoints the WAL into the database file
+            size_stopped = database_size(self.db_path)
+        finally:
+            self.stop_adaptor()
+            if self.args.keep:
+                print(f"Database kept in {self.db_path}")
+            else:
+                shutil.rmtree(self.workdir, ignore_errors=True)
+
+        return {
+            "config": vars(self.args),
+            "seedSeconds": seed_seconds,
+            "startupSeconds": startup,
+            "durationSeconds": round(duration, 3),
+            "requests": self.recorder.summary(duration),
+            "insertedRows": self.recorder.inserted,
+            "rowsPerSecond": round(self.recorder.inserted / duration, 1),
+            "databaseBytes": {
+                "seeded": size_seeded,
+                "afterRun": size_run,
+                "afterStop": size_stopped,
+                "growth": size_stopped - size_seeded,
+                "growthPerRow": round((size_stopped - size_seeded) / self.recorder.inserted, 1) if self.recorder.inserted else None
+            },
+            "adaptorProcess": process,
+            "adaptorStats": stats
+        }
+
+
+def print_report(results):
+    if results["seedSeconds"] is not None:
+        print(f"\nseeding: {results['config']['rows']} violations in {results['seedSeconds']} s")
+    print(f"adaptor startup: {results['startupSeconds']} s")
+    print()
+    print(f"{'request':<14}{'count':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in results["requests"].items():
+        print(f"{name:<14}{r['requests']:>10}{r['errors']:>8}{r['throughput']:>10}"
+              f"{r['p50Ms'] or '-':>10}{r['p99Ms'] or '-':>10}{r['maxMs'] or '-':>10}")
+    print(f"\ninserted: {results['insertedRows']} rows, {results['rowsPerSecond']} rows/s")
+    size = results["databaseBytes"]
+    print(f"database: {size['seeded']} B seeded, {size['afterRun']} B at the end of the run (WAL included), "
+          f"{size['afterStop']} B checkpointed, growth {size['growth']} B ({size['growthPerRow']} B/row)")
+    process = results["adaptorProcess"]
+    print(f"adaptor process: {process['cpuSeconds']} CPU s ({process['cpuPercent']}%), RSS {process['rssBytes']} B")
+    cache = results["adaptorStats"].get("cache")
+    if cache is not None:
+        print(f"query cache: {json.dumps({k: v for k, v in cache.items() if k != 'seenPlates'})}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load benchmark of the database adaptor")
+    parser.add_argument('--rows', type=int, default=1000000, help="violations of the seeded history")
+    parser.add_argument('--plates', type=int, default=100000, help="distinct plates of the history and of the posts")
+    parser.add_argument('--stations', type=int, default=4)
+    parser.add_argument('--history-days', type=float, default=365, help="the history covers the last days")
+    parser.add_argument('--db', help="copy this database instead of seeding one (e.g. kept with --keep)")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary database after the run")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of mixed requests")
+    parser.add_argument('--clients', type=int, default=8, help="threads sending requests")
+    parser.add_argument('--rate', type=float, default=0, help="requests/s of each client, 0 for no limit")
+    parser.add_argument('--post-ratio', type=float, default=0.3, help="fraction of the requests that are posts")
+    parser.add_argument('--post-batch', type=int, default=1, help="violations of each post, > 1 uses /batch")
+    parser.add_argument('--plate-ratio', type=float, default=0.3, help="fraction of plate searches")
+    parser.add_argument('--unknown-ratio', type=float, default=0.1, help="fraction of the plate searches of unknown plates")
+    parser.add_argument('--station-ratio', type=float, default=0.2, help="fraction of station searches, the rest are date ranges")
+    parser.add_argument('--page-size', type=int, default=100, help="limit of the station and date range searches")
+    parser.add_argument('--range-hours', type=float, default=24, help="window of the date range searches")
+    parser.add_argument('--write-max-latency-ms', type=float, default=10)
+    parser.add_argument('--write-max-batch', type=int, default=500)
+    parser.add_argument('--cache-entries', type=int, default=1024, help="query cache entries, 0 disables it")
+    parser.add_argument('--thread-pool', type=int, default=10, help="cherrypy threads of the adaptor")
+    parser.add_argument('--port', type=int, default=0, help="port of the adaptor, a free one by default")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the synthetic history and of the requests")
+    parser.add_argument('--json', help="also write the results in this file, to compare runs")
+    args = parser.parse_args()
+    if args.post_ratio + args.plate_ratio + args.station_ratio > 1:
+        parser.error("--post-ratio, --plate-ratio and --station-ratio must sum to at most 1")
+    if args.range_hours * 3600 > args.history_days * 86400:
+        parser.error("--range-hours must fit in --history-days")
+
+    results = DatabaseBenchmark(args).run()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+
+import database_adaptor
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def schema_adaptor():
+    # only the connection handling of DatabaseAdaptor, enough for init_db (no server, no threads)
+    adaptor = database_adaptor.DatabaseAdaptor.__new__(database_adaptor.DatabaseAdaptor)
+    adaptor.local = threading.local()
+    adaptor.connections = []
+    adaptor.connections_lock = threading.Lock()
+    return adaptor
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.workdir, "database.db")
+        self.saved_db_path = database_adaptor.DB_PATH
+        database_adaptor.DB_PATH = self.db_path
+
+    def tearDown(self):
+        database_adaptor.DB_PATH = self.saved_db_path
+        shutil.rmtree(self.workdir)
+
+    def init_db(self, migrations):
+        saved = database_adaptor.MIGRATIONS
+        database_adaptor.MIGRATIONS = migrations
+        adaptor = schema_adaptor()
+        try:
+            adaptor.init_db()
+        finally:
+            database_adaptor.MIGRATIONS = saved
+            for conn in adaptor.connections:
+                conn.close()
+
+    def schema(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(plate_rollup)")]
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            return version, columns, tables
+        finally:
+            conn.close()
+
+    def test_interrupted_migration_is_applied_again(self):
+        # a database at schema version 3 with some violations
+        self.init_db(database_adaptor.MIGRATIONS[:3])
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.executemany(database_adaptor.INSERT_VIOLATION, [("AB123CD", "1700000000", 1, "1700000000"),
+                                                                 ("EF456GH", "1700003600", 2, "1700003600")])
+            conn.execute("INSERT INTO plate_rollup (plate, count) VALUES ('AB123CD', 1), ('EF456GH', 1)")
+        conn.close()
+
+        # the process dies in the middle of migration 4, after its ADD COLUMNs
+        crash = textwrap.dedent(f'''
+            import os, sys, threading
+            sys.path.insert(0, {script_dir!r})
+            import database_adaptor
+            database_adaptor.DB_PATH = {self.db_path!r}
+            migration = list(database_adaptor.MIGRATIONS[3])
+            database_adaptor.MIGRATIONS[3] = migration[:2] + ["SELECT crash()"] + migration[2:]
+            adaptor = database_adaptor.DatabaseAdaptor.__new__(database_adaptor.DatabaseAdaptor)
+            adaptor.local = threading.local()
+            adaptor.connections = []
+            adaptor.connections_lock = threading.Lock()
+            adaptor.get_connection().create_function("crash", 0, lambda: os._exit(3))
+            adaptor.init_db()
+        ''')
+        result = subprocess.run([sys.executable, "-c", crash], capture_output=True)
+        self.assertEqual(result.returncode, 3, result.stderr.decode())
+
+        version, columns, tables = self.schema()
+        self.assertEqual(version, 3)
+        self.assertNotIn("first_seen", columns)
+        self.assertNotIn("plate_stations", tables)
+
+        # the next start applies the whole migration
+        self.init_db(database_adaptor.MIGRATIONS)
+        version, columns, tables = self.schema()
+        self.assertEqual(version, len(database_adaptor.MIGRATIONS))
+        self.assertIn("first_seen", columns)
+        self.assertIn("plate_stations", tables)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            self.assertEqual(conn.execute("SELECT first_seen FROM plate_rollup WHERE plate = 'AB123CD'").fetchone()[0],
+                             1700000000.0)
+        finally:
+            conn.close()
+
+    def test_failed_migration_is_rolled_back(self):
+        self.init_db(database_adaptor.MIGRATIONS[:3])
+        broken = database_adaptor.MIGRATIONS[:3] + [database_adaptor.MIGRATIONS[3][:2] + ["SELECT * FROM missing_table"]]
+        with self.assertRaises(sqlite3.OperationalError):
+            self.init_db(broken)
+        version, columns, _ = self.schema()
+        self.assertEqual(version, 3)
+        self.assertNotIn("last_seen", columns)
+
+
+class PlateSearchTest(unittest.TestCase):
+
+    def test_prefix_and_fuzzy_are_normalized(self):
+        self.assertEqual(database_adaptor.parse_plate_search({'plate_prefix': ' ab1 '}),
+                         {'plate': None, 'plate_prefix': 'AB1'})
+        self.assertEqual(database_adaptor.parse_plate_search({'plate_fuzzy': 'ab123cd'}),
+                         {'plate': None, 'plate_fuzzy': 'AB123CD'})
+
+    def test_blank_prefix_or_fuzzy_is_rejected(self):
+        # a blank value would otherwise mean no filter and return every violation
+        for params in ({'plate_prefix': ' '}, {'plate_fuzzy': '  '}):
+            with self.assertRaises(ValueError):
+                database_adaptor.parse_plate_search(params)
+
+    def test_only_one_plate_filter(self):
+        with self.assertRaises(ValueError):
+            database_adaptor.parse_plate_search({'plate': 'AB123CD', 'plate_prefix': 'AB'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,457 @@
+'''
+load benchmark of the resource catalog
+
+starts TLCatalogManager in a child process on a local port (with an empty temporary
+catalog.json, no MQTT broker is needed), registers N simulated devices with bulk
+registrations, then for --duration seconds:
+    - every device sends a heartbeat every --interval seconds, with +/- --jitter random
+      jitter; with --storm all the devices start at the same time (e.g. after a network
+      outage) instead of being spread over the first interval
+    - --readers threads mix GET /resourceID and GET /allResources requests
+
+reports p50/p99 latency and throughput of each kind of request, how late heartbeats were
+sent compared to their schedule (load generator saturated), and CPU, memory and disk
+usage of the catalog process read from /proc
+
+example:
+    python catalog_benchmark.py --devices 50000 --duration 60 --storage journal --json results.json
+'''
+import argparse
+import heapq
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+DEVICE_TYPES = (
+    ("LED", ["MQTT"], "Led"),
+    ("Button", ["MQTT"], "PedestrianButton"),
+    ("PresenceSensor", ["MQTT"], "PresenceSensor"),
+    ("InfractionSensor", ["MQTT"], "Infraction"),
+    ("DHT", ["MQTT"], "sensor"),
+)
+
+
+def run_catalog(info_path, catalog_file, port, thread_pool):
+    # entry point of the catalog process
+    import cherrypy
+    from resource_catalog_server import TLCatalogManager
+
+    manager = TLCatalogManager(info_path, catalog_file)
+    conf = {
+        '/': {
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher()
+        }
+    }
+    cherrypy.tree.mount(manager, '/', conf)
+    cherrypy.config.update({'server.socket_host': '127.0.0.1',
+                            'server.socket_port': port,
+                            'server.thread_pool': thread_pool,
+                            'engine.autoreload.on': False,
+                            'log.screen': False})
+    cherrypy.engine.subscribe('stop', manager.stop)
+    cherrypy.engine.signal_handler.subscribe()
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+# free_port, percentile and ProcessMonitor are also copied in database/database_benchmark.py
+# (every service directory keeps its own copy, like MyMQTT.py), a fix to them goes to both
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def device_description(index, base_topic):
+    device_type, services, topic_name = DEVICE_TYPES[index % len(DEVICE_TYPES)]
+    zone = "ABCD"[index % 4]
+    device_id = f"bench_{device_type}_{index}"
+    return {
+        "ID": device_id,
+        "Name": f"bench{device_type}",
+        "Type": device_type,
+        "zone": zone,
+        "availableServices": services,
+        "servicesDetails": [
+            {
+                "serviceType": "MQTT",
+                "topic": f"{base_topic}/{zone}/{topic_name}/{device_id}"
+            }
+        ]
+    }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+class ProcessMonitor(object):
+    '''
+    CPU time, resident memory and disk I/O of a process, from /proc
+    '''
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf('SC_CLK_TCK')
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            # the command name may contain spaces, fields are counted after its ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks #utime + stime
+
+    def rss_bytes(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+        return None
+
+    def io(self):
+        # not readable in some containers
+        try:
+            with open(f"/proc/{self.pid}/io") as f:
+                counters = dict(line.split(': ') for line in f.read().splitlines())
+            return {"readBytes": int(counters['read_bytes']), "writeBytes": int(counters['write_bytes'])}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def sample(self):
+        return {"time": time.time(), "cpu": self.cpu_seconds(), "io": self.io()}
+
+    def usage(self, before, after):
+        elapsed = after["time"] - before["time"]
+        cpu = after["cpu"] - before["cpu"]
+        usage = {"cpuSeconds": round(cpu, 3),
+                 "cpuPercent": round(100 * cpu / elapsed, 1) if elapsed > 0 else None,
+                 "rssBytes": self.rss_bytes(),
+                 "readBytes": None,
+                 "writeBytes": None}
+        if before["io"] is not None and after["io"] is not None:
+            usage["readBytes"] = after["io"]["readBytes"] - before["io"]["readBytes"]
+            usage["writeBytes"] = after["io"]["writeBytes"] - before["io"]["writeBytes"]
+        return usage
+
+
+class CatalogConnection(object):
+    '''
+    keep-alive HTTP connection to the catalog, one for each load generator thread
+    '''
+
+    def __init__(self, port, timeout=30):
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        # returns (status, latency in ms, response body), status None on connection errors
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None, (time.perf_counter() - start) * 1000, None
+        return response.status, (time.perf_counter() - start) * 1000, data
+
+
+class Recorder(object):
+    # latencies of each kind of request, merged from the load generator threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, name, latencies, errors):
+        with self.lock:
+            self.latencies.setdefault(name, []).extend(latencies)
+            self.errors[name] = self.errors.get(name, 0) + errors
+
+    def summary(self, duration):
+        results = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            results[name] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput": round(len(latencies) / duration, 1),
+                "p50Ms": round(percentile(latencies, 50), 3) if latencies else None,
+                "p99Ms": round(percentile(latencies, 99), 3) if latencies else None,
+                "maxMs": round(latencies[-1], 3) if latencies else None
+            }
+        return results
+
+
+class CatalogBenchmark(object):
+
+    def __init__(self, args):
+        self.args = args
+        self.port = args.port or free_port()
+        self.workdir = tempfile.mkdtemp(prefix="catalog_benchmark_")
+        self.catalog_file = os.path.join(self.workdir, "catalog.json")
+        self.info_path = os.path.join(self.workdir, "resource_catalog_info.json")
+        self.process = None
+        self.recorder = Recorder()
+        self.etags = {} #ID -> ETag of the registration, sent with the heartbeats
+        self.stop_event = threading.Event()
+        self.due = queue.Queue(maxsize=10000) #heartbeats whose time has come
+        self.lag = [] #delay of the heartbeats compared to their schedule (ms)
+        self.lag_lock = threading.Lock()
+
+    def prepare(self):
+        # empty catalog with the broker of the real one, the broker is never contacted
+        with open(os.path.join(script_dir, "catalog.json")) as f:
+            catalog = json.load(f)
+        catalog['resourcesList'] = []
+        catalog.pop('version', None)
+        self.base_topic = catalog.get('base_topic', 'SmartTrafficLight')
+        with open(self.catalog_file, 'w') as f:
+            json.dump(catalog, f, indent=4)
+
+        info = {
+            "ip_address": "127.0.0.1",
+            "ip_port": str(self.port),
+            "base_topic": self.base_topic,
+            "catalog_storage": self.args.storage,
+            "catalog_flush_interval_ms": self.args.flush_interval_ms,
+            "catalog_compact_every": self.args.compact_every,
+            "catalog_heartbeat_interval_s": self.args.interval,
+            "catalog_ttl_missed_heartbeats": self.args.missed_heartbeats,
+            "catalog_change_feed": False
+        }
+        with open(self.info_path, 'w') as f:
+            json.dump(info, f, indent=4)
+
+    def start_catalog(self):
+        self.process = multiprocessing.Process(target=run_catalog, name="catalog",
+                                               args=(self.info_path, self.catalog_file, self.port, self.args.thread_pool))
+        self.process.start()
+        connection = CatalogConnection(self.port, timeout=1)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            status, _, _ = connection.request('GET', '/broker')
+            if status == 200:
+                return
+            time.sleep(0.1)
+        raise RuntimeError("the catalog did not start")
+
+    def stop_catalog(self):
+        if self.process is None:
+            return
+        os.kill(self.process.pid, signal.SIGTERM) #the catalog flushes on stop
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def register_devices(self):
+        connection = CatalogConnection(self.port)
+        devices = [device_description(i, self.base_topic) for i in range(self.args.devices)]
+        latencies = []
+        errors = 0
+        for start in range(0, len(devices), self.args.batch):
+            status, latency, data = connection.request('PUT', '/registerResources', devices[start:start + self.args.batch])
+            latencies.append(latency)
+            if status != 200:
+                errors += 1
+                continue
+            for result in json.loads(data)['results']:
+                self.etags[result['ID']] = result.get('etag')
+        # registrations are reported apart, they are not part of the measured window
+        registration = Recorder()
+        registration.add('registerResources', latencies, errors)
+        return [device['ID'] for device in devices], registration
+
+    def schedule_heartbeats(self, device_ids, start):
+        '''
+        puts every heartbeat on the due queue at its scheduled time
+        each device keeps its own period, interval +/- jitter
+        '''
+        interval = self.args.interval
+        heap = []
+        for device_id in device_ids:
+            first = start if self.args.storm else start + random.uniform(0, interval)
+            heap.append((first, device_id))
+        heapq.heapify(heap)
+        while heap and not self.stop_event.is_set():
+            due, device_id = heap[0]
+            delay = due - time.time()
+            if delay > 0:
+                self.stop_event.wait(min(delay, 0.05))
+                continue
+            heapq.heappop(heap)
+            try:
+                self.due.put((due, device_id), timeout=1)
+            except queue.Full:
+                continue #the workers are saturated, the heartbeat is skipped
+            jitter = random.uniform(-self.args.jitter, self.args.jitter) * interval
+            heapq.heappush(heap, (due + interval + jitter, device_id))
+
+    def heartbeat_worker(self):
+        connection = CatalogConnection(self.port)
+        latencies = []
+        lags = []
+        errors = 0
+        while not self.stop_event.is_set():
+            try:
+                due, device_id = self.due.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            lags.append((time.time() - due) * 1000)
+            etag = self.etags.get(device_id)
+            headers = {'If-Match': etag} if etag else {}
+            status, latency, _ = connection.request('PUT', '/heartbeat', {"ID": device_id}, headers)
+            latencies.append(latency)
+            if status != 200:
+                errors += 1
+        self.recorder.add('heartbeat', latencies, errors)
+        with self.lag_lock:
+            self.lag.extend(lags)
+
+    def reader(self, device_ids):
+        connection = CatalogConnection(self.port)
+        latencies = {'resourceID': [], 'allResources': []}
+        errors = {'resourceID': 0, 'allResources': 0}
+        period = 1.0 / self.args.read_rate if self.args.read_rate > 0 else 0
+        next_read = time.time()
+        while not self.stop_event.is_set():
+            if random.random() < self.args.all_ratio:
+                name, path = 'allResources', '/allResources'
+            else:
+                name, path = 'resourceID', f"/resourceID?ID={random.choice(device_ids)}"
+            status, latency, _ = connection.request('GET', path)
+            latencies[name].append(latency)
+            if status != 200:
+                errors[name] += 1
+            if period:
+                next_read += period
+                delay = next_read - time.time()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+        for name in latencies:
+            self.recorder.add(name, latencies[name], errors[name])
+
+    def catalog_stats(self):
+        status, _, data = CatalogConnection(self.port).request('GET', '/stats')
+        return json.loads(data) if status == 200 else None
+
+    def run(self):
+        self.prepare()
+        self.start_catalog()
+        try:
+            monitor = ProcessMonitor(self.process.pid)
+
+            before = monitor.sample()
+            start = time.time()
+            device_ids, recorder = self.register_devices()
+            seconds = time.time() - start
+            registration = {"seconds": round(seconds, 3),
+                            "requests": recorder.summary(seconds),
+                            "process": monitor.usage(before, monitor.sample())}
+            print(f"Registered {len(device_ids)} devices in {registration['seconds']} s")
+
+            threads = [threading.Thread(target=self.schedule_heartbeats, args=(device_ids, time.time()))]
+            threads += [threading.Thread(target=self.heartbeat_worker) for _ in range(self.args.workers)]
+            threads += [threading.Thread(target=self.reader, args=(device_ids,)) for _ in range(self.args.readers)]
+            before = monitor.sample()
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            print(f"Running for {self.args.duration} s...")
+            time.sleep(self.args.duration)
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+            duration = time.time() - start
+            process = monitor.usage(before, monitor.sample())
+            stats = self.catalog_stats()
+        finally:
+            self.stop_catalog()
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+        self.lag.sort()
+        heartbeats_expected = self.args.devices * duration / self.args.interval
+        return {
+            "config": vars(self.args),
+            "registration": registration,
+            "durationSeconds": round(duration, 3),
+            "requests": self.recorder.summary(duration),
+            "heartbeatLag": {
+                "expectedHeartbeats": int(heartbeats_expected),
+                "p50Ms": round(percentile(self.lag, 50), 3) if self.lag else None,
+                "p99Ms": round(percentile(self.lag, 99), 3) if self.lag else None
+            },
+            "catalogProcess": process,
+            "catalogStats": stats
+        }
+
+
+def print_report(results):
+    batches = results["registration"]["requests"]["registerResources"]
+    print(f"\nregistration: {results['registration']['seconds']} s, {batches['requests']} bulk requests "
+          f"({batches['errors']} errors), p50 {batches['p50Ms']} ms, p99 {batches['p99Ms']} ms")
+    print()
+    print(f"{'request':<20}{'count':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, r in results["requests"].items():
+        print(f"{name:<20}{r['requests']:>10}{r['errors']:>8}{r['throughput']:>10}"
+              f"{r['p50Ms'] or '-':>10}{r['p99Ms'] or '-':>10}{r['maxMs'] or '-':>10}")
+    lag = results["heartbeatLag"]
+    print(f"\nheartbeats expected: {lag['expectedHeartbeats']}, schedule lag p50 {lag['p50Ms']} ms, p99 {lag['p99Ms']} ms")
+    process = results["catalogProcess"]
+    print(f"catalog process: {process['cpuSeconds']} CPU s ({process['cpuPercent']}%), "
+          f"RSS {process['rssBytes']} B, disk read {process['readBytes']} B, written {process['writeBytes']} B")
+    stats = results["catalogStats"]
+    if stats is not None:
+        print(f"catalog: {stats['resources']} resources, {stats['expiredResources']} expired, "
+              f"persistence {json.dumps(stats['persistence'])}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load benchmark of the resource catalog")
+    parser.add_argument('--devices', type=int, default=1000, help="simulated devices (up to 50000)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of heartbeats and reads")
+    parser.add_argument('--interval', type=float, default=10, help="heartbeat interval of each device (s)")
+    parser.add_argument('--jitter', type=float, default=0.2, help="heartbeat jitter, fraction of the interval")
+    parser.add_argument('--storm', action='store_true', help="all the devices send their first heartbeat together")
+    parser.add_argument('--missed-heartbeats', type=int, default=3, help="missed heartbeats before a device expires")
+    parser.add_argument('--workers', type=int, default=16, help="threads sending the heartbeats")
+    parser.add_argument('--readers', type=int, default=4, help="threads sending GET requests")
+    parser.add_argument('--read-rate', type=float, default=20, help="requests/s of each reader, 0 for no limit")
+    parser.add_argument('--all-ratio', type=float, default=0.1, help="fraction of the reads that are /allResources")
+    parser.add_argument('--batch', type=int, default=500, help="devices in each bulk registration")
+    parser.add_argument('--storage', choices=('snapshot', 'journal', 'sqlite'), default='snapshot')
+    parser.add_argument('--flush-interval-ms', type=int, default=500)
+    parser.add_argument('--compact-every', type=int, default=10000)
+    parser.add_argument('--thread-pool', type=int, default=10, help="cherrypy threads of the catalog")
+    parser.add_argument('--port', type=int, default=0, help="port of the catalog, a free one by default")
+    parser.add_argument('--json', help="also write the results in this file, to compare runs")
+    args = parser.parse_args()
+    if not 0 < args.devices <= 50000:
+        parser.error("--devices must be between 1 and 50000")
+
+    results = CatalogBenchmark(args).run()
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
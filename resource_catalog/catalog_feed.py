@@ -0,0 +1,97 @@
+import queue
+import threading
+import time
+
+from MyMQTT import MyMQTT
+
+
+def topic_level(resource_id):
+    # IDs are used as a topic level, MQTT wildcards and separators are not allowed in it
+    return str(resource_id).replace('/', '_').replace('+', '_').replace('#', '_')
+
+
+class CatalogChangeFeed(object):
+    '''
+    publishes the changes of the catalog on the MQTT broker advertised under "broker",
+    so clients can keep a local mirror of the catalog instead of polling it over HTTP
+
+    <base_topic>/catalog/resources/<ID>  (retained)
+        {"op": "upsert", "version": v, "resource": {...}} when a description is added or changed
+        {"op": "expire", "version": v, "ID": id} when it expires, followed by an empty retained
+        message that clears the topic (new subscribers will not receive it anymore)
+    <base_topic>/catalog/version  (retained)
+        {"version": v, "lastUpdate": t}, the version of the last published change
+
+    a client subscribes to <base_topic>/catalog/# : the retained messages give it the whole
+    catalog, then every change arrives with its version number (empty payloads are ignored)
+    heartbeats are not published, they do not change the catalog version
+    events are queued by the request threads and published by a background thread
+    '''
+
+    def __init__(self, broker, port, base_topic, client_id="resource_catalog_feed"):
+        self.resources_topic = f"{base_topic}/catalog/resources"
+        self.version_topic = f"{base_topic}/catalog/version"
+        self.client = MyMQTT(client_id, broker, port, None)
+        self.events = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.published = 0
+
+    def publish_upsert(self, resource, version):
+        self.events.put(("upsert", resource, version))
+
+    def publish_expire(self, resource_id, version):
+        self.events.put(("expire", resource_id, version))
+
+    def publish_snapshot(self, resources, version):
+        # (re)publishes the retained state of every resource, used at startup
+        for resource in resources:
+            self.publish_upsert(resource, version)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="catalog_feed", daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        # the broker may not be reachable yet when the catalog starts
+        while not self.stop_event.is_set():
+            try:
+                self.client.start()
+                return True
+            except Exception as e:
+                print(f"Catalog change feed cannot connect to the broker: {e}")
+                self.stop_event.wait(5)
+        return False
+
+    def run(self):
+        if not self.connect():
+            return
+        while not self.stop_event.is_set():
+            try:
+                op, payload, version = self.events.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                if op == "upsert":
+                    topic = f"{self.resources_topic}/{topic_level(payload['ID'])}"
+                    self.client.myPublish(topic, {"op": "upsert", "version": version, "resource": payload}, retain=True)
+                else:
+                    topic = f"{self.resources_topic}/{topic_level(payload)}"
+                    self.client.myPublish(topic, {"op": "expire", "version": version, "ID": payload})
+                    self.client.myPublish(topic, None, retain=True)
+                self.client.myPublish(self.version_topic, {"version": version, "lastUpdate": time.time()}, retain=True)
+                self.published += 1
+            except Exception as e:
+                print(f"Catalog change feed publish failed: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        try:
+            self.client.stop()
+        except Exception:
+            pass
+
+    def stats(self):
+        return {"published": self.published, "queued": self.events.qsize()}
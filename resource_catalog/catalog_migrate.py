@@ -0,0 +1,82 @@
+'''
+moves the catalog between the JSON file backend (catalog.json) and the SQLite backend
+(catalog.db), run it with the resource catalog stopped, then set "catalog_storage"
+in resource_catalog_info.json to the new backend
+
+    python catalog_migrate.py json-to-sqlite [--json catalog.json] [--db catalog.db]
+    python catalog_migrate.py sqlite-to-json [--json catalog.json] [--db catalog.db]
+
+with the journal backend, catalog.journal is replayed on top of catalog.json
+'''
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+
+from catalog_persistence import journal_file_of, replay_journal_files, write_json_atomically
+from catalog_sqlite import load_catalog_db, write_catalog_db
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def replay_journal(json_file, document):
+    # applies the records of catalog.journal not yet compacted in catalog.json, read only
+    resources = OrderedDict((resource['ID'], resource) for resource in document.get('resourcesList', []))
+
+    def upsert(resource, timestamp):
+        resources.pop(resource['ID'], None)
+        resources[resource['ID']] = resource
+
+    def touch(resource_id, timestamp):
+        if resource_id in resources:
+            resource = dict(resources.pop(resource_id))
+            resource['lastUpdate'] = timestamp
+            resources[resource_id] = resource
+
+    def delete(resource_id, timestamp):
+        resources.pop(resource_id, None)
+
+    replayed = replay_journal_files(journal_file_of(json_file), upsert, touch, delete)
+    document['resourcesList'] = list(resources.values())
+    return replayed
+
+
+def json_to_sqlite(json_file, db_file):
+    with open(json_file) as f:
+        document = json.load(f)
+    journal_file = journal_file_of(json_file)
+    if os.path.exists(journal_file) or os.path.exists(journal_file + '.old'):
+        print(f"Replayed {replay_journal(json_file, document)} journal records")
+    write_catalog_db(db_file, document)
+    return len(document.get('resourcesList', []))
+
+
+def sqlite_to_json(db_file, json_file):
+    document = load_catalog_db(db_file)
+    if document is None:
+        raise ValueError(f"{db_file} holds no catalog")
+    # same key order of catalog.json, resources last
+    resources = document.pop('resourcesList')
+    document['resourcesList'] = resources
+    write_json_atomically(json_file, document)
+    return len(resources)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrate the resource catalog between the JSON and SQLite backends")
+    parser.add_argument('direction', choices=('json-to-sqlite', 'sqlite-to-json'))
+    parser.add_argument('--json', default=os.path.join(script_dir, 'catalog.json'), help="catalog.json file")
+    parser.add_argument('--db', default=os.path.join(script_dir, 'catalog.db'), help="SQLite catalog file")
+    args = parser.parse_args()
+
+    try:
+        if args.direction == 'json-to-sqlite':
+            count = json_to_sqlite(args.json, args.db)
+            print(f"Migrated {count} resources from {args.json} to {args.db}")
+        else:
+            count = sqlite_to_json(args.db, args.json)
+            print(f"Migrated {count} resources from {args.db} to {args.json}")
+    except (OSError, ValueError) as e:
+        print(f"Migration failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,319 @@
+import errno
+import json
+import os
+import threading
+import time
+
+
+def write_json_atomically(path, document, indent=4):
+    '''
+    writes the document in a temporary file next to the target and renames it over the
+    target, so a crash during the dump never leaves a truncated catalog.json
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as tmp_file:
+        json.dump(document, tmp_file, indent=indent)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    try:
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # a single file bind-mounted by docker cannot be replaced (EBUSY), nor a file on another
+        # file system (EXDEV): only in these cases it is rewritten in place, which is not atomic
+        if e.errno not in (errno.EBUSY, errno.EXDEV):
+            raise
+        print(f"Cannot rename over {path} ({e.strerror}), rewriting it in place: mount its directory instead")
+        with open(tmp_path) as tmp_file, open(path, 'w') as target_file:
+            target_file.write(tmp_file.read())
+            target_file.flush()
+            os.fsync(target_file.fileno())
+        os.remove(tmp_path)
+
+
+class SnapshotPersister(object):
+    '''
+    write-behind persistence of catalog.json
+    mutations only mark the catalog as dirty, a background thread dumps it at most
+    once every flush_interval_ms, so a burst of registrations costs a single write
+    '''
+
+    def __init__(self, catalog_file, build_document, flush_interval_ms=500):
+        self.catalog_file = catalog_file
+        self.build_document = build_document #callable returning the document to dump
+        self.flush_interval = flush_interval_ms / 1000.0
+
+        self.dirty = threading.Event()
+        self.running = False
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.last_flush = 0
+
+        # statistics
+        self.pending_writes = 0 #mutations not yet on disk
+        self.writes = 0
+        self.flushes = 0
+        self.coalesced_writes = 0
+        self.last_flush_ms = 0
+        self.max_flush_ms = 0
+        self.total_flush_ms = 0
+
+    def mark_dirty(self):
+        self.pending_writes += 1
+        self.writes += 1
+        self.dirty.set()
+
+    # the whole catalog is dumped on flush, so every kind of mutation only marks it dirty
+    def record_upsert(self, resource, timestamp):
+        self.mark_dirty()
+
+    def record_upserts(self, resources, timestamp):
+        self.mark_dirty()
+
+    def record_touch(self, resource_id, timestamp):
+        self.mark_dirty()
+
+    def record_delete(self, resource_id, timestamp):
+        self.mark_dirty()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="catalog_persister", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.dirty.wait()
+            if not self.running:
+                break
+            # wait until flush_interval is passed since the last flush, meanwhile writes are coalesced
+            delay = self.last_flush + self.flush_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if not self.running:
+                break #stop() already flushed
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Catalog flush failed: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        with self.flush_lock:
+            if not self.dirty.is_set():
+                return
+            self.dirty.clear()
+            pending = self.pending_writes
+            self.pending_writes = 0
+
+            start = time.perf_counter()
+            write_json_atomically(self.catalog_file, self.build_document())
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.last_flush = time.time()
+
+            self.flushes += 1
+            self.coalesced_writes += max(pending - 1, 0)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    def stop(self):
+        '''
+        flushes the pending mutations, called when the cherrypy engine stops
+        '''
+        self.running = False
+        self.flush()
+        # wake up the thread so it can exit
+        self.dirty.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval + 1)
+
+    def stats(self):
+        return {
+            "mode": "snapshot",
+            "flushIntervalMs": self.flush_interval * 1000,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "coalescedWrites": self.coalesced_writes,
+            "pendingWrites": self.pending_writes,
+            "lastFlushMs": round(self.last_flush_ms, 3),
+            "maxFlushMs": round(self.max_flush_ms, 3),
+            "avgFlushMs": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0
+        }
+
+
+def journal_file_of(catalog_file):
+    return os.path.splitext(catalog_file)[0] + '.journal'
+
+
+def replay_journal_files(journal_file, apply_upsert, apply_touch, apply_delete):
+    '''
+    applies the records of journal_file.old (being compacted) and then of journal_file,
+    only reading them: missing files are skipped, nothing is created
+    returns the number of replayed records
+    '''
+    replayed = 0
+    for path in (journal_file + '.old', journal_file):
+        if not os.path.exists(path):
+            continue
+        with open(path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line truncated by a crash during the append
+                    print(f"Skipping corrupted journal record in {path}")
+                    continue
+                if record['op'] == 'put':
+                    apply_upsert(record['r'], record['t'])
+                elif record['op'] == 'touch':
+                    apply_touch(record['ID'], record['t'])
+                elif record['op'] == 'del':
+                    apply_delete(record['ID'], record['t'])
+                replayed += 1
+    return replayed
+
+
+class JournalPersister(object):
+    '''
+    append-only persistence of the catalog
+    every upsert/delete appends one compact line to the journal file, so the cost of a
+    heartbeat does not depend on the number of registered devices
+    a background thread fsyncs the journal every flush_interval_ms and, when the journal
+    holds more than compact_every records, compacts it into a new catalog.json snapshot
+    at startup the snapshot is loaded and the journal is replayed on top of it
+    '''
+
+    def __init__(self, catalog_file, build_document, journal_file=None, flush_interval_ms=500, compact_every=10000):
+        self.catalog_file = catalog_file
+        self.build_document = build_document #callable returning the snapshot document
+        self.journal_file = journal_file or journal_file_of(catalog_file)
+        # journal being compacted, it is replayed before the current one
+        self.old_journal_file = self.journal_file + '.old'
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.compact_every = compact_every
+
+        self.journal_lock = threading.Lock()
+        self.journal = open(self.journal_file, 'a')
+        if self.journal.tell() > 0:
+            # terminate a record truncated by a crash, so the next append starts on a new line
+            with open(self.journal_file, 'rb') as journal:
+                journal.seek(-1, os.SEEK_END)
+                if journal.read(1) != b'\n':
+                    self.journal.write('\n')
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # statistics
+        self.records = 0
+        self.records_since_compaction = 0
+        self.unsynced = 0
+        self.syncs = 0
+        self.compactions = 0
+        self.last_compaction_ms = 0
+        self.last_sync_ms = 0
+
+    def replay(self, apply_upsert, apply_touch, apply_delete):
+        '''
+        applies the journals (the one being compacted first) on top of the loaded snapshot
+        returns the number of replayed records
+        '''
+        replayed = replay_journal_files(self.journal_file, apply_upsert, apply_touch, apply_delete)
+        self.records_since_compaction = replayed
+        return replayed
+
+    def append(self, *records):
+        # several records are written with a single write
+        lines = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
+        with self.journal_lock:
+            self.journal.write(lines)
+            self.records += len(records)
+            self.records_since_compaction += len(records)
+            self.unsynced += len(records)
+
+    def record_upsert(self, resource, timestamp):
+        self.append({"op": "put", "t": timestamp, "r": resource})
+
+    def record_upserts(self, resources, timestamp):
+        self.append(*[{"op": "put", "t": timestamp, "r": resource} for resource in resources])
+
+    def record_touch(self, resource_id, timestamp):
+        # heartbeats only carry the ID, the timestamp is the new lastUpdate
+        self.append({"op": "touch", "t": timestamp, "ID": resource_id})
+
+    def record_delete(self, resource_id, timestamp):
+        self.append({"op": "del", "t": timestamp, "ID": resource_id})
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="catalog_journal", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.sync()
+                if self.records_since_compaction >= self.compact_every:
+                    self.compact()
+            except Exception as e:
+                print(f"Catalog journal error: {e}")
+
+    def sync(self):
+        with self.journal_lock:
+            if not self.unsynced:
+                return
+            start = time.perf_counter()
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.unsynced = 0
+            self.syncs += 1
+            self.last_sync_ms = (time.perf_counter() - start) * 1000
+
+    def compact(self):
+        '''
+        rotates the journal and writes a new snapshot of the catalog
+        records appended after the rotation go to a fresh journal; replaying them over a
+        snapshot that already contains some of them is harmless because every record
+        carries the full resource
+        '''
+        start = time.perf_counter()
+        with self.journal_lock:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal.close()
+            if os.path.exists(self.old_journal_file):
+                # a previous compaction did not complete, keep its records
+                with open(self.journal_file) as journal, open(self.old_journal_file, 'a') as old_journal:
+                    old_journal.write(journal.read())
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, self.old_journal_file)
+            self.journal = open(self.journal_file, 'a')
+            self.records_since_compaction = 0
+            self.unsynced = 0
+
+        write_json_atomically(self.catalog_file, self.build_document())
+        os.remove(self.old_journal_file)
+
+        self.compactions += 1
+        self.last_compaction_ms = (time.perf_counter() - start) * 1000
+
+    def stop(self):
+        '''
+        syncs the journal, called when the cherrypy engine stops
+        '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval + 1)
+        self.sync()
+
+    def stats(self):
+        return {
+            "mode": "journal",
+            "flushIntervalMs": self.flush_interval * 1000,
+            "records": self.records,
+            "recordsSinceCompaction": self.records_since_compaction,
+            "syncs": self.syncs,
+            "lastSyncMs": round(self.last_sync_ms, 3),
+            "compactEvery": self.compact_every,
+            "compactions": self.compactions,
+            "lastCompactionMs": round(self.last_compaction_ms, 3)
+        }
@@ -0,0 +1,239 @@
+import itertools
+import json
+import sqlite3
+import threading
+import time
+
+# ID has no declared type, so integer and string IDs are kept distinct like in catalog.json
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS resources (
+        ID PRIMARY KEY,
+        zone TEXT,
+        Type TEXT,
+        lastUpdate REAL,
+        position INTEGER NOT NULL,
+        description TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_resources_zone ON resources(zone)',
+    'CREATE INDEX IF NOT EXISTS idx_resources_type ON resources(Type)',
+    'CREATE INDEX IF NOT EXISTS idx_resources_last_update ON resources(lastUpdate)',
+    'CREATE INDEX IF NOT EXISTS idx_resources_position ON resources(position)',
+    # the other keys of catalog.json (broker, base_topic, lastUpdate, version), JSON encoded
+    'CREATE TABLE IF NOT EXISTS catalog (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+]
+
+
+def open_catalog_db(db_file):
+    connection = sqlite3.connect(db_file)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL') #WAL stays consistent, a power loss may lose the last commit
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+def resource_row(resource, position, last_update=None):
+    '''
+    values of a row of the resources table
+    the description is stored as it is, zone/Type/lastUpdate are copied in indexed columns
+    '''
+    last_update = resource.get('lastUpdate') if last_update is None else last_update
+    zone = resource.get('zone', resource.get('Zone'))
+    resource_type = resource.get('Type')
+    return (resource['ID'], None if zone is None else str(zone), None if resource_type is None else str(resource_type),
+            last_update, position, json.dumps(resource, separators=(',', ':')))
+
+
+UPSERT = '''INSERT INTO resources (ID, zone, Type, lastUpdate, position, description) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ID) DO UPDATE SET zone=excluded.zone, Type=excluded.Type, lastUpdate=excluded.lastUpdate,
+            position=excluded.position, description=excluded.description'''
+
+
+def load_catalog_db(db_file):
+    '''
+    reads the catalog stored in db_file, with the same layout of catalog.json
+    returns None if the database holds no catalog yet
+    '''
+    connection = open_catalog_db(db_file)
+    try:
+        document = {key: json.loads(value) for key, value in connection.execute('SELECT key, value FROM catalog')}
+        if not document:
+            return None
+        resources = []
+        # heartbeats only update the lastUpdate column, not the description
+        for last_update, description in connection.execute('SELECT lastUpdate, description FROM resources ORDER BY position'):
+            resource = json.loads(description)
+            if last_update is not None:
+                resource['lastUpdate'] = last_update
+            resources.append(resource)
+        document['resourcesList'] = resources
+        return document
+    finally:
+        connection.close()
+
+
+def write_catalog_db(db_file, document):
+    '''
+    replaces the catalog stored in db_file with a catalog.json document
+    '''
+    connection = open_catalog_db(db_file)
+    try:
+        with connection:
+            connection.execute('DELETE FROM resources')
+            connection.execute('DELETE FROM catalog')
+            connection.executemany(UPSERT, [resource_row(resource, position)
+                                            for position, resource in enumerate(document.get('resourcesList', []))])
+            connection.executemany('INSERT INTO catalog (key, value) VALUES (?, ?)',
+                                   [(key, json.dumps(value)) for key, value in document.items() if key != 'resourcesList'])
+    finally:
+        connection.close()
+
+
+class SqlitePersister(object):
+    '''
+    persistence of the catalog in an indexed SQLite table (WAL mode), one row per resource
+    mutations are coalesced by ID and written by a background thread in a single transaction
+    every flush_interval_ms; a heartbeat only updates the lastUpdate of its row
+    the other catalog keys are rewritten in the catalog table at every flush
+    '''
+
+    def __init__(self, db_file, build_meta, flush_interval_ms=500):
+        self.db_file = db_file
+        self.build_meta = build_meta #callable returning the catalog keys without resourcesList
+        self.flush_interval = flush_interval_ms / 1000.0
+
+        # ID -> pending operation, only the last state of each resource is written
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # position of the last written resource, the order continues across restarts
+        connection = open_catalog_db(db_file)
+        try:
+            last_position = connection.execute('SELECT MAX(position) FROM resources').fetchone()[0]
+        finally:
+            connection.close()
+        self.positions = itertools.count(0 if last_position is None else last_position + 1)
+        self.dirty = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # statistics
+        self.writes = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0
+        self.max_flush_ms = 0
+        self.total_flush_ms = 0
+
+    def record(self, resource_id, operation):
+        with self.pending_lock:
+            previous = self.pending.get(resource_id)
+            if operation[0] == 'touch' and previous is not None and previous[0] == 'put':
+                # the description to insert did not change, only its lastUpdate and position
+                operation = ('put', previous[1], operation[1], operation[2])
+            self.pending[resource_id] = operation
+            self.writes += 1
+        self.dirty.set()
+
+    def record_upsert(self, resource, timestamp):
+        self.record(resource['ID'], ('put', resource, resource.get('lastUpdate', timestamp), next(self.positions)))
+
+    def record_upserts(self, resources, timestamp):
+        for resource in resources:
+            self.record_upsert(resource, timestamp)
+
+    def record_touch(self, resource_id, timestamp):
+        self.record(resource_id, ('touch', timestamp, next(self.positions)))
+
+    def record_delete(self, resource_id, timestamp):
+        self.record(resource_id, ('del',))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="catalog_sqlite", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        connection = open_catalog_db(self.db_file) #sqlite connections stay in their thread
+        try:
+            while not self.stop_event.is_set():
+                self.dirty.wait()
+                # coalesce the mutations of the flush interval into one transaction
+                if self.stop_event.wait(self.flush_interval):
+                    break
+                try:
+                    self.flush(connection)
+                except Exception as e:
+                    print(f"Catalog flush failed: {e}")
+        finally:
+            connection.close()
+
+    def flush(self, connection):
+        with self.flush_lock:
+            # catalog keys first, so the stored version is never newer than the stored rows
+            meta = self.build_meta()
+            with self.pending_lock:
+                self.dirty.clear()
+                pending, self.pending = self.pending, {}
+
+            start = time.perf_counter()
+            upserts, touches, deletes = [], [], []
+            for resource_id, operation in pending.items():
+                if operation[0] == 'put':
+                    upserts.append(resource_row(operation[1], operation[3], operation[2]))
+                elif operation[0] == 'touch':
+                    touches.append((operation[1], operation[2], resource_id))
+                else:
+                    deletes.append((resource_id,))
+            try:
+                with connection:
+                    connection.executemany(UPSERT, upserts)
+                    connection.executemany('UPDATE resources SET lastUpdate=?, position=? WHERE ID=?', touches)
+                    connection.executemany('DELETE FROM resources WHERE ID=?', deletes)
+                    connection.executemany('INSERT OR REPLACE INTO catalog (key, value) VALUES (?, ?)',
+                                           [(key, json.dumps(value)) for key, value in meta.items()])
+            except Exception:
+                # the transaction is rolled back, keep the mutations not superseded meanwhile
+                with self.pending_lock:
+                    for resource_id, operation in pending.items():
+                        newer = self.pending.get(resource_id)
+                        if newer is None:
+                            self.pending[resource_id] = operation
+                        elif newer[0] == 'touch' and operation[0] == 'put':
+                            self.pending[resource_id] = ('put', operation[1], newer[1], newer[2])
+                    self.dirty.set()
+                raise
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            self.flushes += 1
+            self.rows_written += len(pending)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    def stop(self):
+        '''
+        writes the pending mutations, called when the cherrypy engine stops
+        '''
+        self.stop_event.set()
+        self.dirty.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval + 1)
+        connection = open_catalog_db(self.db_file)
+        try:
+            self.flush(connection)
+        finally:
+            connection.close()
+
+    def stats(self):
+        return {
+            "mode": "sqlite",
+            "flushIntervalMs": self.flush_interval * 1000,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "rowsWritten": self.rows_written,
+            "pendingWrites": len(self.pending),
+            "lastFlushMs": round(self.last_flush_ms, 3),
+            "maxFlushMs": round(self.max_flush_ms, 3),
+            "avgFlushMs": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0
+        }
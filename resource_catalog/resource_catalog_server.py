@@ -2,6 +2,11 @@ import cherrypy
 import json
 import time
 import os
+import threading
+from resource_store import ResourceStore, FILTERS, matches, resource_error
+from catalog_persistence import SnapshotPersister, JournalPersister
+from catalog_sqlite import SqlitePersister, load_catalog_db
+from catalog_feed import CatalogChangeFeed
 
 #every 10 seconds periodically registers in the service_catalog_server
 class TLCatalogManager(object):
@@ -14,48 +19,261 @@ class TLCatalogManager(object):
     and also updates the system thanks to the methods of TLCatalogManager
     '''
 
-    def __init__(self, resource_catalog_info):
+    def __init__(self, resource_catalog_info, catalog_file=None):
             # Get the absolute path of the script
             script_dir = os.path.dirname(os.path.abspath(__file__))    
 
-            # Construct the path for catalog.json
-            self.catalog_file = os.path.join(script_dir, "catalog.json") #local archive for the info of the registerd devices and the broker
+            # Construct the path for catalog.json (another file can be given, e.g. by the benchmark)
+            self.catalog_file = catalog_file or os.path.join(script_dir, "catalog.json") #local archive for the info of the registerd devices and the broker
             self.catalog_file = os.path.normpath(self.catalog_file)
 
-            # Load the catalog.json
-            self.catalog = json.load(open(self.catalog_file))
-
             # Load the resource catalog info
             self.resource_cat_info = json.load(open(resource_catalog_info))
 
+            # a resource that misses ttl_missed_heartbeats heartbeats in a row is expired,
+            # unless its description sets its own "ttl" (seconds)
+            heartbeat_interval = float(self.resource_cat_info.get('catalog_heartbeat_interval_s', 10))
+            missed_heartbeats = float(self.resource_cat_info.get('catalog_ttl_missed_heartbeats', 3))
+            default_ttl = heartbeat_interval * missed_heartbeats
+
+            storage = self.resource_cat_info.get('catalog_storage', 'snapshot')
+            self.db_file = os.path.join(os.path.dirname(self.catalog_file),
+                                        self.resource_cat_info.get('catalog_db_file', 'catalog.db'))
+
+            # Load the catalog.json, or the SQLite catalog
+            self.catalog = None
+            if storage == 'sqlite':
+                self.catalog = load_catalog_db(self.db_file)
+            seed_db = self.catalog is None and storage == 'sqlite' #empty database, filled from catalog.json
+            if self.catalog is None:
+                self.catalog = json.load(open(self.catalog_file))
+            # resources are kept in an ID-keyed index instead of a list to scan
+            self.resources = ResourceStore(self.catalog.pop('resourcesList', []), default_ttl=default_ttl,
+                                           version=self.catalog.pop('version', 0))
+
+            # pre-serialized responses: the broker never changes at runtime, /allResources is
+            # serialized again only after a mutation (store generation)
+            self.broker_json = json.dumps(self.catalog['broker']).encode('utf-8')
+            self.all_resources_cache = (None, None)
+
+            # writers (PUTs, sweeper, journal replay) are serialized by this lock, the only
+            # mutation path of the catalog; readers use immutable snapshots and take it only to
+            # refresh the snapshot after a description changed, or for a delta (see snapshot())
+            self.lock = threading.Lock()
+            self.current_snapshot = self.resources.snapshot()
+
+            flush_interval_ms = int(self.resource_cat_info.get('catalog_flush_interval_ms', 500))
+            if storage == 'sqlite':
+                # one indexed row per resource, mutations are written in batches by a background thread
+                self.persister = SqlitePersister(self.db_file, self.catalog_meta, flush_interval_ms)
+                if seed_db:
+                    self.persister.record_upserts(self.resources.resources(), time.time())
+            elif storage == 'journal':
+                # every mutation is appended to catalog.journal, compacted into catalog.json in background
+                compact_every = int(self.resource_cat_info.get('catalog_compact_every', 10000))
+                self.persister = JournalPersister(self.catalog_file, self.catalog_document,
+                                                  flush_interval_ms=flush_interval_ms, compact_every=compact_every)
+                replayed = self.persister.replay(self.replay_upsert, self.apply_touch, self.apply_delete)
+                print(f"Replayed {replayed} catalog journal records")
+            else:
+                # catalog.json is written behind: PUTs mark it dirty and it is flushed at most every flush interval
+                self.persister = SnapshotPersister(self.catalog_file, self.catalog_document, flush_interval_ms)
+            self.persister.start()
+
+            # optional change feed on the MQTT broker, for clients mirroring the catalog
+            self.feed = None
+            if self.resource_cat_info.get('catalog_change_feed', False):
+                self.feed = CatalogChangeFeed(self.catalog['broker']['name'], self.catalog['broker']['port'],
+                                              self.catalog.get('base_topic', 'SmartTrafficLight'))
+                self.feed.publish_snapshot(self.resources.resources(), self.resources.version)
+                self.feed.start()
+
+            # background thread removing the resources that stopped sending heartbeats
+            self.sweeper_stop = threading.Event()
+            self.sweeper = threading.Thread(target=self.sweep_expired, name="catalog_sweeper", daemon=True)
+            self.sweeper.start()
+
+    def apply_upsert(self, resource, timestamp):
+        self.resources.upsert(resource)
+        # Update "lastUpdate" of resource catalog catalog.json
+        self.catalog['lastUpdate'] = timestamp
+
+    def replay_upsert(self, resource, timestamp):
+        # journal records are checked like the resources loaded from catalog.json
+        error = resource_error(resource)
+        if error is not None:
+            print(f"Skipping journal record of an invalid resource: {error}")
+            return
+        self.apply_upsert(resource, timestamp)
+
+    def apply_touch(self, resource_id, timestamp):
+        self.resources.touch(resource_id, timestamp)
+        self.catalog['lastUpdate'] = timestamp
+
+    def apply_delete(self, resource_id, timestamp):
+        self.resources.delete(resource_id)
+        self.catalog['lastUpdate'] = timestamp
+
+    def sweep_expired(self):
+        '''
+        sleeps until the earliest expiry deadline (at most one second, so that new shorter
+        deadlines are not missed) and removes the expired resources
+        '''
+        while True:
+            next_deadline = self.resources.next_deadline()
+            timeout = 1.0 if next_deadline is None else min(max(next_deadline - time.time(), 0), 1.0)
+            if self.sweeper_stop.wait(timeout):
+                return
+            now = time.time()
+            with self.lock:
+                for resource_id, version in self.resources.expire(now):
+                    self.persister.record_delete(resource_id, now)
+                    self.catalog['lastUpdate'] = now
+                    if self.feed is not None:
+                        # the version of this removal, like /allResources?since= reports it
+                        self.feed.publish_expire(resource_id, version)
+                    print(f"Resource {resource_id} expired")
+
+    def snapshot(self):
+        '''
+        immutable view of the catalog for the readers
+        the last snapshot is reused while no mutation happened, otherwise a new one is
+        taken under the writers lock (a copy of the references, O(n), not of the resources)
+        when only heartbeats happened since the last snapshot the lock is not waited for:
+        if a writer holds it the previous snapshot is returned, only its lastUpdate values
+        are behind, so heartbeat load never queues the readers behind the writers
+        '''
+        snapshot = self.current_snapshot
+        if snapshot.generation != self.resources.generation:
+            description_changed = snapshot.version != self.resources.version
+            if self.lock.acquire(blocking=description_changed):
+                try:
+                    snapshot = self.resources.snapshot()
+                    self.current_snapshot = snapshot
+                finally:
+                    self.lock.release()
+        return snapshot
+
+    def catalog_document(self):
+        '''
+        rebuilds the catalog.json document from the broker info and the resource index,
+        keeping the original order of the keys
+        '''
+        with self.lock:
+            document = {}
+            for key, value in self.catalog.items():
+                document[key] = value
+            snapshot = self.resources.snapshot()
+        document['version'] = snapshot.version
+        document['resourcesList'] = list(snapshot.resources)
+        return document
+
+    def catalog_meta(self):
+        # catalog keys without the resources, stored apart by the SQLite backend
+        with self.lock:
+            document = dict(self.catalog)
+            document['version'] = self.resources.version
+        return document
+
+    def all_resources_json(self):
+        snapshot = self.snapshot()
+        generation, output = self.all_resources_cache
+        if generation != snapshot.generation:
+            # serialized outside the lock, the snapshot cannot change meanwhile
+            output = json.dumps(list(snapshot.resources)).encode('utf-8')
+            self.all_resources_cache = (snapshot.generation, output)
+        return output
+
+    def resources_delta(self, since, filters):
+        '''
+        resources changed and removed after version since
+        if the delta is not available anymore the full list is returned with "full": true
+        the changelog is read under the writers lock, deltas are meant to be small
+        '''
+        with self.lock:
+            version = self.resources.version
+            delta = self.resources.changes_since(since)
+            if delta is None:
+                changed, removed, full = self.resources.query(**filters), [], True
+            else:
+                changed, removed = delta
+                changed, full = [r for r in changed if matches(r, filters)], False
+        return json.dumps({"version": version, "since": since, "full": full,
+                           "resources": changed, "removed": removed})
+
+    def stop(self):
+        # flush the pending mutations before exiting
+        self.sweeper_stop.set()
+        self.persister.stop()
+        if self.feed is not None:
+            self.feed.stop()
+
 
     def GET(self, *uri, **params):
         '''
         when a client does a GET the server reads the data in resoucesList (in catalog.json) to answer the request
         '''
         if len(uri[0]) > 0:
-            if (uri[0] != 'broker') and (uri[0] != 'allResources') and (uri[0] != 'resourceID'):
+            if uri[0] not in ('broker', 'allResources', 'resourceID', 'stats'):
                 error_string = "incorrect URI:\n" + str(uri)
                 raise cherrypy.HTTPError(400, error_string)
             else:
                 if uri[0] == 'broker':
                     # Retrieve information about broker
-                    brokerInfo = self.catalog['broker']
-                    return json.dumps(brokerInfo)
+                    return self.broker_json
+
+                # ?includeExpired=true also returns the last expired resources, for debugging
+                include_expired = params.get('includeExpired', 'false').lower() in ('true', '1', 'yes')
 
                 if uri[0] == 'allResources':
-                    # Retrieve all registered devices
-                    output = json.dumps(self.catalog['resourcesList'])
+                    # Retrieve all registered devices, optionally filtered by zone, Type, serviceType
+                    # and topic (prefix), e.g. /allResources?zone=A&Type=LED
+                    # conditional GET: the (weak) ETag is the catalog version, which changes only when a
+                    # description is added, changed or removed, not on heartbeats
+                    etag = 'W/"%d"' % self.resources.version
+                    cherrypy.response.headers['ETag'] = etag
+                    if etag in cherrypy.request.headers.get('If-None-Match', '').split(', '):
+                        cherrypy.response.status = 304
+                        return b''
+
+                    filters = {name: params[name] for name in FILTERS if name in params}
+                    if 'since' in params:
+                        # delta mode: only what changed after the given version
+                        try:
+                            since = int(params['since'])
+                        except ValueError:
+                            raise cherrypy.HTTPError(400, 'since must be a catalog version number')
+                        return self.resources_delta(since, filters)
+                    if not filters and not include_expired:
+                        return self.all_resources_json()
+
+                    if filters:
+                        resources = self.resources.query(**filters) #copy-on-write indexes, no lock needed
+                    else:
+                        resources = list(self.snapshot().resources)
+                    if include_expired:
+                        resources += [r for r in self.snapshot().expired if matches(r, filters)]
+                    output = json.dumps(resources)
                     return output
 
                 if uri[0] == 'resourceID':
                     # accept alphanumeric IDs
                     target_id = params['ID']
-                    for item in self.catalog['resourcesList']:
-                        if item['ID'] == target_id:
-                            return json.dumps(item)
+                    item = self.resources.get(target_id)
+                    if item is None and include_expired:
+                        item = self.resources.get_expired(target_id)
+                    if item is not None:
+                        return json.dumps(item)
                     return 'Resource/Device ID not found'
 
+                if uri[0] == 'stats':
+                    # persistence statistics (flush latency, coalesced writes)
+                    return json.dumps({"resources": len(self.resources),
+                                       "expiredResources": len(self.resources.expired),
+                                       "version": self.resources.version,
+                                       "persistence": self.persister.stats(),
+                                       "changeFeed": self.feed.stats() if self.feed is not None else None})
+
 
     #PUT used to register resouces in the service, receives a json message with the resource info
     def PUT(self, *uri, **params):
@@ -66,48 +284,121 @@ class TLCatalogManager(object):
             json_body["lastUpdate"] = time.time() #also update last update time
             id = json_body['ID'] #iD of the resource
             try:
-                for item in self.catalog['resourcesList']:  #for all registered resources in the catalog.json
-                    if id == item['ID']: #look for the one with the same ID, if there is (so the resources its already registered)
-                        #then just UPDATE its info
-                        devicesList = self.catalog['resourcesList']
-                        devicesList.remove(item) #remove the old version
-                        devicesList.append(json_body) #append the new version
-                        self.catalog['resourcesList'] = devicesList
-                        # Update "lastUpdate" of resource catalog catalog.json
-                        self.catalog['lastUpdate'] = time.time()
-                        catalog_file = open(self.catalog_file, "w")
-                        json.dump(self.catalog, catalog_file , indent=4) #dump the updated catalog
-                        return 'Registered successfully'
-
-                #if the resources has not been found in the catalog then add it, REGISTRATION
-                self.catalog['resourcesList'].append(json_body)
-                # Update "lastUpdate" of resource catalog
-                self.catalog['lastUpdate'] = time.time()
-                catalog_file = open(self.catalog_file, "w")
-                json.dump(self.catalog, catalog_file , indent=4)
+                # if the resource is already registered just UPDATE its info, otherwise add it (REGISTRATION)
+                with self.lock:
+                    now = time.time()
+                    version = self.resources.version
+                    self.apply_upsert(json_body, now)
+                    self.persister.record_upsert(json_body, now) #catalog.json is written by the persister thread
+                    if self.feed is not None and self.resources.version != version:
+                        # only new or changed descriptions are published, not re-registrations
+                        self.feed.publish_upsert(json_body, self.resources.version)
+                    # clients send it back with their heartbeats while the description does not change
+                    cherrypy.response.headers['ETag'] = self.resources.get_etag(id)
                 return 'Registered successfully'
             except:
                 return 'An error occurred during registration of Resource'
 
+        elif uri[0] == 'registerResources':
+            '''
+            bulk registration, e.g. from a gateway hosting many devices: the body is an array of
+            resource descriptions, applied as one catalog mutation with a single persistence write
+            returns the status of each item, in the same order
+            '''
+            try:
+                json_body = json.loads(cherrypy.request.body.read())
+            except ValueError:
+                raise cherrypy.HTTPError(400, 'Invalid JSON format')
+            if not isinstance(json_body, list):
+                raise cherrypy.HTTPError(400, 'registerResources expects an array of resources')
+
+            # invalid items are reported before anything is applied
+            errors = [resource_error(item) for item in json_body]
+            results = []
+            registered = []
+            with self.lock:
+                now = time.time()
+                try:
+                    for item, error in zip(json_body, errors):
+                        if error is not None:
+                            item_id = item.get('ID') if isinstance(item, dict) else None
+                            results.append({"ID": item_id if isinstance(item_id, (str, int)) else None,
+                                            "status": "error", "error": error})
+                            continue
+                        item["lastUpdate"] = now
+                        version = self.resources.version
+                        is_new = item['ID'] not in self.resources
+                        try:
+                            self.apply_upsert(item, now)
+                        except (TypeError, ValueError) as e:
+                            # the store is left untouched by a failed upsert
+                            results.append({"ID": item['ID'], "status": "error", "error": str(e)})
+                            continue
+                        if is_new:
+                            status = "registered"
+                        elif self.resources.version != version:
+                            status = "updated"
+                        else:
+                            status = "unchanged"
+                        if self.feed is not None and status != "unchanged":
+                            self.feed.publish_upsert(item, self.resources.version)
+                        registered.append(item)
+                        results.append({"ID": item['ID'], "status": status, "etag": self.resources.get_etag(item['ID'])})
+                finally:
+                    # whatever was applied is persisted, even if the batch stopped halfway
+                    if registered:
+                        self.persister.record_upserts(registered, now)
+            return json.dumps({"results": results})
+
+        elif uri[0] == 'heartbeat':
+            '''
+            lightweight keep-alive: the body only carries the ID of an already registered resource,
+            its lastUpdate is refreshed without sending (and parsing, and storing) the full description
+            If-Match: <ETag of the last registration> is optional, if it does not match the
+            registered description 412 is returned and the client has to register again
+            '''
+            try:
+                id = json.loads(cherrypy.request.body.read())['ID']
+            except (ValueError, KeyError, TypeError):
+                raise cherrypy.HTTPError(400, 'heartbeat body must be {"ID": <resource ID>}')
+            error = resource_error({'ID': id}) #same ID check of the registrations
+            if error is not None:
+                raise cherrypy.HTTPError(400, error)
+
+            etag = cherrypy.request.headers.get('If-Match')
+            with self.lock:
+                if id not in self.resources:
+                    raise cherrypy.HTTPError(404, 'Resource/Device ID not found')
+                if etag is not None and etag != self.resources.get_etag(id):
+                    raise cherrypy.HTTPError(412, 'Resource description changed, register it again')
+                now = time.time()
+                self.apply_touch(id, now)
+                self.persister.record_touch(id, now)
+                cherrypy.response.headers['ETag'] = self.resources.get_etag(id)
+            return 'OK'
+
 
 if __name__ == '__main__':
     # automatically retrieve resource_catalog_info.json path
     resource_info_path = "resource_catalog_info.json"
 
-    res_cat_server = TLCatalogManager(resource_info_path)
+    # CATALOG_FILE places catalog.json (and catalog.journal, catalog.db) in a mounted directory (Docker)
+    res_cat_server = TLCatalogManager(resource_info_path, os.environ.get("CATALOG_FILE"))
 
     with open(resource_info_path) as f:
         resource_info = json.load(f)
 
     conf = {
         '/': {
-            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
-            'tools.sessions.on': True
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher()
         }
     }
     cherrypy.tree.mount(res_cat_server, '/', conf)
     cherrypy.config.update(conf)
     cherrypy.config.update({'server.socket_host': resource_info['ip_address']})
     cherrypy.config.update({"server.socket_port": int(resource_info['ip_port'])})
+    cherrypy.engine.subscribe('stop', res_cat_server.stop)
+    if hasattr(cherrypy.engine, 'signal_handler'):
+        cherrypy.engine.signal_handler.subscribe() #stop the engine (and flush the catalog) on SIGTERM
     cherrypy.engine.start()
     cherrypy.engine.block()
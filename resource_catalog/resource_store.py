@@ -0,0 +1,363 @@
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import time
+from collections import OrderedDict, namedtuple
+
+
+def resource_etag(resource):
+    '''
+    fingerprint of a resource description, lastUpdate excluded, sent back as ETag so that
+    clients can send a heartbeat instead of the full description when nothing changed
+    '''
+    description = {k: v for k, v in resource.items() if k != 'lastUpdate'}
+    serialized = json.dumps(description, sort_keys=True, separators=(',', ':'))
+    return '"' + hashlib.sha1(serialized.encode('utf-8')).hexdigest() + '"'
+
+
+# query parameters of /allResources backed by a secondary index
+FILTERS = ('zone', 'Type', 'serviceType', 'topic')
+
+
+def list_field(resource, name):
+    # a field that is not a list (malformed description) is not indexed, like a missing one
+    value = resource.get(name)
+    return value if isinstance(value, list) else []
+
+
+def indexed_keys(resource):
+    '''
+    values under which a resource is indexed, for each filter
+    descriptions are not uniform across devices ("zone"/"Zone", "servicesDetails"/"serviceDetails",
+    "topic"/"topicS"/"topic_status"...), all the variants are indexed
+    '''
+    keys = {name: set() for name in FILTERS}
+    zone = resource.get('zone', resource.get('Zone'))
+    if zone is not None:
+        keys['zone'].add(str(zone))
+    if resource.get('Type') is not None:
+        keys['Type'].add(str(resource['Type']))
+    for service in list_field(resource, 'availableServices'):
+        keys['serviceType'].add(str(service))
+    for details in list_field(resource, 'servicesDetails') + list_field(resource, 'serviceDetails'):
+        if not isinstance(details, dict):
+            continue
+        if 'serviceType' in details:
+            keys['serviceType'].add(str(details['serviceType']))
+        for key, value in details.items():
+            if key.startswith('topic') and isinstance(value, str):
+                keys['topic'].add(value)
+    return keys
+
+
+def resource_error(resource):
+    '''
+    reason why a description cannot be registered, None if it can
+    checked before a batch is applied, so that an invalid item cannot stop it halfway
+    '''
+    if not isinstance(resource, dict) or 'ID' not in resource:
+        return "missing ID"
+    if isinstance(resource['ID'], bool) or not isinstance(resource['ID'], (str, int)):
+        return "ID must be a string or an integer"
+    ttl = resource.get('ttl')
+    if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float))):
+        return "ttl must be a number of seconds"
+    last_update = resource.get('lastUpdate')
+    if last_update is not None and (isinstance(last_update, bool) or not isinstance(last_update, (int, float))):
+        return "lastUpdate must be a timestamp"
+    return None
+
+
+def matches(resource, filters):
+    # same semantics of ResourceStore.query, for resources not in the index (expired ones)
+    keys = indexed_keys(resource)
+    for name, value in filters.items():
+        if name == 'topic':
+            if not any(topic.startswith(value) for topic in keys['topic']):
+                return False
+        elif value not in keys[name]:
+            return False
+    return True
+
+
+# immutable view of the store handed to the readers
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['generation', 'version', 'resources', 'expired'])
+
+
+class ResourceStore(object):
+    '''
+    in-memory index of the registered resources, keyed by their ID
+    the index keeps the insertion order, so iterating it gives back the resourcesList
+    in the same order as the old list (an update moves the resource at the end,
+    exactly like the old remove + append)
+    lookup, upsert and delete are O(1) whatever the number of registered devices
+
+    mutations must be serialized by the caller (one writer at a time), while get,
+    get_expired and query can be called concurrently without locks: stored resources
+    are replaced and never modified in place, and the secondary index sets and the
+    topic list are copy-on-write
+
+    every resource expires ttl seconds after its lastUpdate (the "ttl" field of the
+    resource, default_ttl otherwise): deadlines are kept in a min-heap, so finding the
+    expired resources costs O(log n) each instead of a scan of the whole index
+
+    version is bumped when a description is added, changed or removed (a heartbeat or a
+    re-registration of the same description does not change it) and the changelog keeps
+    the version of the last change of each ID, so clients can ask only for what changed
+    since the version they already have
+    generation is bumped by any mutation, heartbeats included
+    '''
+
+    def __init__(self, resources=None, default_ttl=None, max_expired=1000, version=0, max_changelog=10000):
+        self.index = OrderedDict()
+        self.etags = {} #ETag of the registered description of each resource
+        self.default_ttl = default_ttl #None: resources never expire
+
+        # expiry deadlines, the heap may hold outdated entries of resources refreshed
+        # in the meanwhile: only the one matching self.deadlines is valid
+        self.deadlines = {}
+        self.deadline_heap = []
+        self.heap_counter = itertools.count() #tie-breaker, IDs may be int or str
+
+        # last expired resources, kept only for debugging (?includeExpired)
+        self.expired = OrderedDict()
+        self.max_expired = max_expired
+
+        # secondary indexes: filter -> value -> IDs, maintained on upsert/delete
+        self.secondary = {name: {} for name in FILTERS}
+        self.keys_of = {} #ID -> values under which it is indexed, to unindex it
+        self.sorted_topics = [] #distinct topics, sorted for prefix searches
+        # position of each resource in the insertion order, to sort query results
+        self.order = {}
+        self.order_counter = itertools.count()
+
+        # ID -> (version of its last change, removed), oldest change first
+        self.changelog = OrderedDict()
+        self.max_changelog = max_changelog
+        self.version = 0
+        self.generation = 0
+        for item in resources or []:
+            # a malformed stored entry is skipped, it must not stop the catalog from starting
+            error = resource_error(item)
+            if error is not None:
+                print(f"Skipping stored resource {item.get('ID') if isinstance(item, dict) else item!r}: {error}")
+                continue
+            self.upsert(item)
+        # the changes of the loaded resources are not known, older deltas get the full list
+        self.changelog.clear()
+        self.version = version
+        self.delta_horizon = version #deltas since an older version are not available anymore
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, resource_id):
+        return resource_id in self.index
+
+    def get(self, resource_id):
+        return self.index.get(resource_id)
+
+    def get_etag(self, resource_id):
+        return self.etags.get(resource_id)
+
+    def upsert(self, resource):
+        '''
+        register a new resource or replace the old version of an already registered one
+        returns True if the resource was not registered before
+        '''
+        resource_id = resource['ID']
+        # everything that can fail is computed before the store is touched
+        keys = indexed_keys(resource)
+        etag = resource_etag(resource)
+        deadline = self.deadline_of(resource)
+        is_new = resource_id not in self.index
+        self.index[resource_id] = resource
+        self.index.move_to_end(resource_id) #the resource goes at the end of the insertion order
+        if etag != self.etags.get(resource_id):
+            self.etags[resource_id] = etag
+            self.log_change(resource_id, removed=False)
+            # the indexed values depend only on the description
+            self.unindex(resource_id)
+            self.add_to_index(resource_id, keys)
+        self.generation += 1
+        self.expired.pop(resource_id, None)
+        self.schedule_expiry(resource, deadline)
+        self.order[resource_id] = next(self.order_counter)
+        return is_new
+
+    def touch(self, resource_id, timestamp):
+        '''
+        refreshes the lastUpdate of a registered resource (heartbeat), like a re-registration
+        of the same description it moves the resource at the end
+        the stored dict is replaced by an updated copy, never modified in place
+        returns the updated resource, None if it is not registered
+        '''
+        resource = self.index.get(resource_id)
+        if resource is None:
+            return None
+        resource = dict(resource)
+        resource['lastUpdate'] = timestamp
+        deadline = self.deadline_of(resource)
+        self.index[resource_id] = resource
+        self.index.move_to_end(resource_id)
+        self.generation += 1
+        self.schedule_expiry(resource, deadline)
+        self.order[resource_id] = next(self.order_counter) #the description, so the indexes, did not change
+        return resource
+
+    def delete(self, resource_id):
+        # returns the removed resource, None if it was not registered
+        if resource_id in self.index:
+            self.log_change(resource_id, removed=True)
+            self.generation += 1
+        self.etags.pop(resource_id, None)
+        self.deadlines.pop(resource_id, None) #its heap entries are now outdated
+        self.order.pop(resource_id, None)
+        self.unindex(resource_id)
+        return self.index.pop(resource_id, None)
+
+    def log_change(self, resource_id, removed):
+        self.version += 1
+        self.changelog.pop(resource_id, None)
+        self.changelog[resource_id] = (self.version, removed)
+        if len(self.changelog) > self.max_changelog:
+            _, (oldest_version, _) = self.changelog.popitem(last=False)
+            self.delta_horizon = oldest_version
+
+    def changes_since(self, since):
+        '''
+        resources changed and IDs removed after version since, oldest change first
+        returns None if since is too old (or from the future) to build the delta
+        '''
+        if since < self.delta_horizon or since > self.version:
+            return None
+        changed = []
+        removed = []
+        for resource_id in reversed(self.changelog):
+            version, is_removed = self.changelog[resource_id]
+            if version <= since:
+                break
+            if is_removed:
+                removed.append(resource_id)
+            else:
+                changed.append(self.index[resource_id])
+        changed.reverse()
+        removed.reverse()
+        return changed, removed
+
+    # index sets and the topic list are replaced, never modified, so concurrent readers
+    # always iterate a consistent copy; they change only when a description changes
+    def add_to_index(self, resource_id, keys):
+        self.keys_of[resource_id] = keys
+        for name, values in keys.items():
+            for value in values:
+                ids = self.secondary[name].get(value)
+                if ids is None and name == 'topic':
+                    topics = list(self.sorted_topics)
+                    bisect.insort(topics, value)
+                    self.sorted_topics = topics
+                self.secondary[name][value] = (ids or frozenset()) | {resource_id}
+
+    def unindex(self, resource_id):
+        keys = self.keys_of.pop(resource_id, None)
+        if keys is None:
+            return
+        for name, values in keys.items():
+            for value in values:
+                ids = self.secondary[name][value] - {resource_id}
+                if ids:
+                    self.secondary[name][value] = ids
+                else:
+                    del self.secondary[name][value]
+                    if name == 'topic':
+                        topics = list(self.sorted_topics)
+                        del topics[bisect.bisect_left(topics, value)]
+                        self.sorted_topics = topics
+
+    def ids_with_topic_prefix(self, prefix):
+        ids = set()
+        topics = self.sorted_topics
+        start = bisect.bisect_left(topics, prefix)
+        for topic in topics[start:]:
+            if not topic.startswith(prefix):
+                break
+            ids |= self.secondary['topic'].get(topic, frozenset())
+        return ids
+
+    def query(self, **filters):
+        '''
+        resources matching all the given filters (zone, Type, serviceType: exact value,
+        topic: prefix of one of the topics), in insertion order
+        only the matching entries are touched, the index is never scanned
+        '''
+        candidates = []
+        for name, value in filters.items():
+            if name == 'topic':
+                candidates.append(self.ids_with_topic_prefix(value))
+            else:
+                candidates.append(self.secondary[name].get(value, frozenset()))
+        if not candidates:
+            return self.resources()
+        # intersect starting from the smallest set
+        candidates.sort(key=len)
+        ids = set(candidates[0])
+        for other in candidates[1:]:
+            ids &= other
+        # a resource deleted by a concurrent writer is skipped
+        positions = [(self.order.get(resource_id), resource_id) for resource_id in ids]
+        positions = sorted(p for p in positions if p[0] is not None)
+        resources = [self.index.get(resource_id) for _, resource_id in positions]
+        return [resource for resource in resources if resource is not None]
+
+    def ttl_of(self, resource):
+        return resource.get('ttl', self.default_ttl)
+
+    def deadline_of(self, resource):
+        # None if the resource never expires, raises if its ttl or lastUpdate are not numbers
+        ttl = self.ttl_of(resource)
+        if ttl is None:
+            return None
+        return float(resource.get('lastUpdate', time.time())) + float(ttl)
+
+    def schedule_expiry(self, resource, deadline):
+        if deadline is None:
+            return
+        self.deadlines[resource['ID']] = deadline
+        heapq.heappush(self.deadline_heap, (deadline, next(self.heap_counter), resource['ID']))
+
+    def next_deadline(self):
+        # earliest deadline in the heap (maybe outdated), None if nothing can expire
+        return self.deadline_heap[0][0] if self.deadline_heap else None
+
+    def expire(self, now):
+        '''
+        removes the resources whose deadline is passed
+        returns (ID, version of its removal) pairs, in the order they were removed
+        '''
+        removed = []
+        while self.deadline_heap and self.deadline_heap[0][0] <= now:
+            deadline, _, resource_id = heapq.heappop(self.deadline_heap)
+            if self.deadlines.get(resource_id) != deadline:
+                continue #outdated entry, the resource was refreshed or deleted
+            resource = self.delete(resource_id)
+            self.expired[resource_id] = resource
+            if len(self.expired) > self.max_expired:
+                self.expired.popitem(last=False)
+            removed.append((resource_id, self.version))
+        return removed
+
+    def get_expired(self, resource_id):
+        return self.expired.get(resource_id)
+
+    def expired_resources(self):
+        return list(self.expired.values())
+
+    def resources(self):
+        # resources in insertion order, same layout of catalog['resourcesList']
+        return list(self.index.values())
+
+    def snapshot(self):
+        # the caller must hold the writers lock while the snapshot is taken
+        return CatalogSnapshot(self.generation, self.version, tuple(self.index.values()), tuple(self.expired.values()))
@@ -3,6 +3,8 @@ import json
 import os
 from MyMQTT import MyMQTT
 import requests
+import threading
+from catalog_client import CatalogClient
 
 class IceRiskSimulator:
     def __init__(self, sim_info_path, resource_catalog_path):
@@ -22,13 +24,17 @@ class IceRiskSimulator:
         # Initialize MQTT client
         self.client = MyMQTT(self.clientID, self.broker, self.port, self)
 
+        catalog_url = f"http://{self.resource_catalog['ip_address']}:{self.resource_catalog['ip_port']}"
+        self.catalog_client = CatalogClient(catalog_url, resource_info=self.sim_info)
+
     def register(self):
-        request_string = f"http://{self.resource_catalog['ip_address']}:{self.resource_catalog['ip_port']}/registerResource"
-        try:
-            r = requests.put(request_string, json.dumps(self.sim_info, indent=4))
-            print(f"Registration response: {r.text}")
-        except Exception as e:
-            print("Error during registration:", e)
+        # the catalog expires resources that stop sending heartbeats, so refresh every 10 seconds
+        while True:
+            try:
+                self.catalog_client.refresh()
+            except Exception as e:
+                print("Error during registration:", e)
+            time.sleep(10)
 
     def publish_ice_risk(self):
         value = 0.87  # fixed value that triggers LCD warning
@@ -57,7 +63,7 @@ if __name__ == "__main__":
 
     simulator = IceRiskSimulator(sim_info_path, resource_catalog_path)
     simulator.start()
-    simulator.register()
+    threading.Thread(target=simulator.register, daemon=True).start()
 
     try:
         while True:
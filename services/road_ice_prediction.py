@@ -9,6 +9,7 @@ import os
 import threading
 import requests
 import time
+from catalog_client import CatalogClient
 
 class Predictor:
     def __init__(self, predictor_info, resource_catalog_file , dataset_file):
@@ -28,6 +29,9 @@ class Predictor:
         self.topicP = info["servicesDetails"][0]["topicP"]
         self.clientID = info["ID"]
         self.client = MyMQTT(self.clientID, self.broker, self.port, self)
+        # full registration only when the info file changes, heartbeats otherwise
+        catalog_url = 'http://' + self.resource_catalog["ip_address"] + ':' + self.resource_catalog["ip_port"]
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=self.predictor_info)
 
         self.dataset_file = dataset_file
         self.dataset = json.load(open(self.dataset_file))
@@ -37,10 +41,8 @@ class Predictor:
         self.take_model()
 
     def register(self):
-        request_string = 'http://' + self.resource_catalog["ip_address"] + ':' + self.resource_catalog["ip_port"] + '/registerResource'
-        data = json.load(open(self.predictor_info))
         try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
+            r = self.catalog_client.refresh()
             print(f'Response: {r.text}')
         except:
             print("An error occurred during registration")
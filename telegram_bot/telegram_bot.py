@@ -3,16 +3,18 @@ from telepot.loop import MessageLoop
 from telepot.namedtuple import InlineKeyboardMarkup, InlineKeyboardButton
 import time
 import json
-import requests
 import threading
 import os
 import pytz
 from urllib.parse import urlencode
 from datetime import datetime
 from dynamic_charts import generate_chart
+from catalog_client import CatalogClient, ServiceDiscovery, ServiceUnavailable
 from dotenv import load_dotenv
 load_dotenv('/app/.env')
 
+SEARCH_PAGE_SIZE = 20 #violations shown in each message
+
 def format_date(ts):
     try:
         utc_dt = datetime.fromtimestamp(float(ts), tz=pytz.utc)
@@ -40,11 +42,17 @@ class MyBot:
 
         with open(resource_info_path) as f:
             self.resource_info = json.load(f)
+        # full registration only when the description changes, heartbeats otherwise
+        self.catalog_client = CatalogClient(self.catalog_url, resource_info=self.resource_info)
 
-        self.db_connector_url = self.get_db_connector_url()
+        # DB adaptor endpoints cached and refreshed in background, no catalog request per search
+        self.discovery = ServiceDiscovery(self.catalog_url)
+        self.discovery.endpoints("Storage")
         self.authenticated_users = set()
         self.search_params = {}
         self.search_results = {}
+        self.search_filters = {} #filters of the last search, to export it or get its next page
+        self.search_next = {} #cursor of the next page of the last search, None on the last page
 
         # Retrieve data from telegram_bot_info.json
         self.config_data = self.resource_info.get("config", [{}])[0]
@@ -67,23 +75,11 @@ class MyBot:
         while True:
             try:
                 self.resource_info['lastUpdate'] = time.time()
-                requests.put(f"{self.catalog_url}/registerResource", json=self.resource_info)
+                self.catalog_client.refresh()
             except Exception as e:
                 print(f"Catalog registration error: {e}")
             time.sleep(10)
 
-    def get_db_connector_url(self):
-        try:
-            response = requests.get(f"{self.catalog_url}/resourceID?ID=db_connector_1")
-            if response.status_code == 200:
-                service = response.json()
-                for s in service.get("servicesDetails", []):
-                    if s["serviceType"] == "REST":
-                        return s["endpoint"]
-            return None
-        except:
-            return None
-        
     def send_main_menu(self, chat_ID):
         is_logged_in = chat_ID in self.authenticated_users
         login_note = "\n👤 Logged in as authorized agent" if is_logged_in else ""
@@ -162,20 +158,43 @@ class MyBot:
                 self.bot.sendMessage(from_ID, "🔍 Choose advanced search criteria:", reply_markup=keyboard)
             return
 
+        if query_data == "next_page":
+            self.bot.answerCallbackQuery(query_ID)
+            self.show_next_page(from_ID)
+            return
+
         if query_data == "download_csv":
             self.bot.answerCallbackQuery(query_ID)
 
             results = getattr(self, "search_results", {}).get(from_ID)
-            if not results:
+            filters = self.search_filters.get(from_ID)
+            if not results or filters is None:
                 self.bot.sendMessage(from_ID, "⚠️ No results available for download.")
                 return
 
+            # the whole search is streamed by the adaptor (NDJSON) and written line by line
             filename = f"violations_{from_ID}.csv"
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write("Plate,Date,Station\n")
-                for r in results:
-                    date_str = format_date(r['date'])
-                    f.write(f"{r['plate']},{date_str},{r['station']}\n")
+            try:
+                path = "/export?" + urlencode(dict(filters, format="ndjson"))
+                response = self.discovery.request("Storage", "GET", path, stream=True)
+            except ServiceUnavailable:
+                self.bot.sendMessage(from_ID, "Database Connector unavailable.")
+                return
+            try:
+                with response, open(filename, "w", encoding="utf-8") as f:
+                    if response.status_code != 200:
+                        raise Exception(f"HTTP {response.status_code}")
+                    f.write("Plate,Date,Station\n")
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        r = json.loads(line)
+                        date_str = format_date(r['date'])
+                        f.write(f"{r['plate']},{date_str},{r['station']}\n")
+            except Exception as e:
+                self.bot.sendMessage(from_ID, f"❌ Error: {e}")
+                os.remove(filename)
+                return
 
             with open(filename, "rb") as f:
                 self.bot.sendDocument(from_ID, f, caption="📎 Violations CSV exported")
@@ -193,7 +212,7 @@ class MyBot:
             return
 
         if query_data == "plate":
-            self.bot.sendMessage(from_ID, "🚗 Enter license plate:")
+            self.bot.sendMessage(from_ID, "🚗 Enter license plate (end it with * to search a partial plate):")
         elif query_data == "semaphore":
             self.bot.sendMessage(from_ID, "🚦 Enter semaphore ID:")
         elif query_data == "date_range":
@@ -303,7 +322,10 @@ class MyBot:
         if mode == "plate" and "plate" not in params:
             plate = message.strip().upper()
             params["plate"] = plate
-            self.execute_search(chat_ID, {"plate": plate})
+            if plate.endswith("*") and plate.rstrip("*"):
+                self.execute_search(chat_ID, {"plate_prefix": plate.rstrip("*")})
+            else:
+                self.execute_search(chat_ID, {"plate": plate})
 
         elif mode == "semaphore" and "semaforo_id" not in params:
             params["semaforo_id"] = message
@@ -342,45 +364,78 @@ class MyBot:
                     self.bot.sendMessage(chat_ID, f"❌ Error: {e}")
                 return
 
-    def execute_search(self, chat_ID, filters, repeat=False):
-        db_url = self.get_db_connector_url()
-        if not db_url:
+    def fetch_violations(self, filters, cursor=None, limit=SEARCH_PAGE_SIZE):
+        """ One page of the search, returns (violations, cursor of the next page or None) """
+        params = dict(filters, limit=limit)
+        if cursor:
+            params["cursor"] = cursor
+        response = self.discovery.request("Storage", "GET", "/?" + urlencode(params))
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        page = response.json()
+        return page["items"], page["next"]
+
+    def send_results_page(self, chat_ID, violations):
+        """ Sends a page of results, with the export and next page buttons """
+        if violations:
+            reply = "\n".join([
+                f"Plate: {x['plate']}, Date: {format_date(x['date'])}, Semaphore: {x['station']}"
+                for x in violations
+            ])
+            if self.search_next.get(chat_ID):
+                reply += "\n…"
+        else:
+            reply = "✅ No violations found."
+        self.bot.sendMessage(chat_ID, reply)
+
+        # Show export button if at least 2 results are found, next page button if there are more
+        buttons = []
+        if len(self.search_results.get(chat_ID, [])) >= 2:
+            buttons.append([InlineKeyboardButton(text="⬇️ Download CSV", callback_data="download_csv")])
+        if self.search_next.get(chat_ID):
+            buttons.append([InlineKeyboardButton(text="➡️ Next page", callback_data="next_page")])
+        if buttons:
+            self.bot.sendMessage(chat_ID, "📄 Export options:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+    def show_next_page(self, chat_ID):
+        filters = self.search_filters.get(chat_ID)
+        cursor = self.search_next.get(chat_ID)
+        if filters is None or not cursor:
+            self.bot.sendMessage(chat_ID, "⚠️ No more results.")
+            return
+        try:
+            violations, self.search_next[chat_ID] = self.fetch_violations(filters, cursor)
+        except ServiceUnavailable:
             self.bot.sendMessage(chat_ID, "Database Connector unavailable.")
             return
+        except Exception as e:
+            self.bot.sendMessage(chat_ID, f"❌ Error: {e}")
+            return
+        self.search_results[chat_ID] = violations
+        self.send_results_page(chat_ID, violations)
 
+    def execute_search(self, chat_ID, filters, repeat=False):
         if not repeat:
             self.search_params.pop(chat_ID, None)
 
-        url = db_url.rstrip("/") + "/?" + urlencode(filters)
-
+        # only the first page is fetched, the next ones on request
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                violations = response.json()
+            violations, next_cursor = self.fetch_violations(filters)
+            if not violations and "plate" in filters and chat_ID in self.authenticated_users:
+                # the plate may be misread: officers get the violations of the plates differing by one character
+                similar_filters = {"plate_fuzzy": filters["plate"]}
+                violations, next_cursor = self.fetch_violations(similar_filters)
                 if violations:
-                    reply = "\n".join([
-                        f"Plate: {x['plate']}, Date: {format_date(x['date'])}, Semaphore: {x['station']}"
-                        for x in violations
-                    ])
-                    self.search_results = getattr(self, "search_results", {})
-                    self.search_results[chat_ID] = violations  # Save results for export
-                else:
-                    reply = "✅ No violations found."
-                    self.search_results = getattr(self, "search_results", {})
-                    self.search_results[chat_ID] = []
-            else:
-                reply = "❌ Error retrieving data."
+                    self.bot.sendMessage(chat_ID, "🔎 No exact match, violations of similar plates:")
+                    filters = similar_filters
+            self.search_results[chat_ID] = violations  # Save results for export
+            self.search_filters[chat_ID] = filters
+            self.search_next[chat_ID] = next_cursor
+            self.send_results_page(chat_ID, violations)
         except Exception as e:
-            reply = f"❌ Error: {e}"
-
-        self.bot.sendMessage(chat_ID, reply)
-
-        # Show export button if at least 2 results are found
-        if self.search_results.get(chat_ID) and len(self.search_results[chat_ID]) >= 2:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬇️ Download CSV", callback_data="download_csv")]
-            ])
-            self.bot.sendMessage(chat_ID, "📄 Export options:", reply_markup=keyboard)
+            self.search_results[chat_ID] = []
+            self.search_next.pop(chat_ID, None)
+            self.bot.sendMessage(chat_ID, f"❌ Error retrieving data: {e}")
 
         # Re-prompt after results if date_range mode
         if repeat and "from" in filters and "to" in filters:
@@ -391,7 +446,7 @@ class MyBot:
             self.bot.sendMessage(chat_ID, "📝 Enter new end date (DD-MM-YYYY), type 'edit start' to change start date, or 'exit' to stop:")
 
         elif chat_ID in self.authenticated_users:
-            if "plate" in filters:
+            if "plate" in filters or "plate_prefix" in filters or "plate_fuzzy" in filters:
                 self.search_params[chat_ID] = {"mode": "plate"}
                 self.bot.sendMessage(chat_ID, "🔁 Enter another license plate or type 'exit' to stop:")
             elif "station" in filters:
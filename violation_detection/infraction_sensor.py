@@ -5,6 +5,7 @@ import requests
 from gpiozero import DistanceSensor
 import threading
 import os
+from catalog_client import CatalogClient
 
 class InfractionSensor:
     def __init__(self, infractionSensor_info, resource_catalog_file, info_file):
@@ -28,6 +29,9 @@ class InfractionSensor:
         self.topic_infraction = info["servicesDetails"][0]["topic_infraction"]
         self.clientID = info["ID"]
         self.client = MyMQTT(self.clientID, self.broker, self.port, self)
+        # full registration only when the info file changes, heartbeats otherwise
+        catalog_url = 'http://' + self.resource_catalog["ip_address"] + ':' + self.resource_catalog["ip_port"]
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=self.infractionSensor_info)
         self.distance_threshold = info["distance_threshold"]
         self.warning_cooldown = info["warning_cooldown"]
         self.infraction_cooldown = info.get("infraction_cooldown", 2)
@@ -42,10 +46,8 @@ class InfractionSensor:
         self.converter = { "NS": 2, "WE": 1 }
 
     def register(self):
-        request_string = f"http://{self.resource_catalog['ip_address']}:{self.resource_catalog['ip_port']}/registerResource"
-        data = json.load(open(self.infractionSensor_info))
         try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
+            r = self.catalog_client.refresh()
             print(f'Response: {r.text}')
         except:
             print("An error occurred during registration")
@@ -3,6 +3,7 @@ import time
 import json
 import requests
 import os
+from catalog_client import CatalogClient
 
 class SIM_InfractionSensor:
     def __init__(self, infractionSensor_info, resource_catalog_file, semaphore_status_path):
@@ -20,6 +21,9 @@ class SIM_InfractionSensor:
         self.topic_infraction = info["servicesDetails"][0]["topic_infraction"]
         self.clientID = info["ID"]
         self.client = MyMQTT(self.clientID, self.broker, self.port, self)
+        # full registration only when the info file changes, heartbeats otherwise
+        catalog_url = 'http://' + self.resource_catalog["ip_address"] + ':' + self.resource_catalog["ip_port"]
+        self.catalog_client = CatalogClient(catalog_url, resource_info_path=self.infractionSensor_info)
         self.distance_threshold = info["distance_threshold"]
         self.warning_cooldown = info["warning_cooldown"]
         self.direction = info["direction"]  # "NS" or "WE"
@@ -33,10 +37,8 @@ class SIM_InfractionSensor:
         return
 
     def register(self):
-        request_string = 'http://' + self.resource_catalog["ip_address"] + ':' + self.resource_catalog["ip_port"] + '/registerResource'
-        data = json.load(open(self.infractionSensor_info))
         try:
-            r = requests.put(request_string, json.dumps(data, indent=4))
+            r = self.catalog_client.refresh()
             print(f'Response: {r.text}')
         except:
             print("An error occurred during registration")
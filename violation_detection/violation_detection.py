@@ -1,11 +1,11 @@
 import json
 import random
 import string
-import requests
 import threading
 import time
 import os
 from MyMQTT import MyMQTT
+from catalog_client import CatalogClient, ServiceDiscovery, ServiceUnavailable
 
 class ViolationDetector:
     def __init__(self, client_id, mqtt_broker, mqtt_port, mqtt_topic,
@@ -26,7 +26,11 @@ class ViolationDetector:
 
         self.catalog_ip = self.resource_catalog_info["ip_address"]
         self.catalog_port = self.resource_catalog_info["ip_port"]
-        self.catalog_register_url = f"http://{self.catalog_ip}:{self.catalog_port}/registerResource"
+        # full registration only when the description changes, heartbeats otherwise
+        self.catalog_client = CatalogClient(f"http://{self.catalog_ip}:{self.catalog_port}",
+                                            resource_info=self.resource_info)
+        # DB adaptor endpoints cached and refreshed in background, no catalog request per violation
+        self.discovery = ServiceDiscovery(f"http://{self.catalog_ip}:{self.catalog_port}")
 
     def start(self):
         """Start MQTT client and subscribe to topic"""
@@ -36,6 +40,7 @@ class ViolationDetector:
 
     def stop(self):
         self.mqtt_client.stop()
+        self.discovery.stop()
 
     def notify(self, topic, payload):
         """Callback when a message is received via MQTT"""
@@ -68,38 +73,16 @@ class ViolationDetector:
         numbers = lambda: ''.join(random.choices(string.digits, k=3))
         return f"{letters()}{numbers()}{letters()}"
 
-    def get_db_adaptor_url(self):
-        """Retrieve DB Adaptor REST URL from service catalog"""
-        try:
-            url = f"http://{self.catalog_ip}:{self.catalog_port}/resourceID?ID=db_connector_1"
-            response = requests.get(url)
-
-            if response.status_code == 200:
-                service_info = response.json()
-                for service in service_info.get("servicesDetails", []):
-                    if service.get("serviceType") == "REST":
-                        endpoint = service["endpoint"]
-                        print(f"DB Adaptor discovered: {endpoint}")
-                        return endpoint
-            else:
-                print(f"Failed to retrieve db adaptor info: HTTP {response.status_code}")
-        except Exception as e:
-            print(f"Error discovering DB adaptor: {e}")
-        return None
-
     def send_violation_to_db(self, data):
-        """Send a new violation to the DB Adaptor"""
-        db_url = self.get_db_adaptor_url()
-        if not db_url:
-            print("Cannot send violation: DB adaptor not available.")
-            return
-
+        """Send a new violation to the DB Adaptor, failing over to the other registered instances"""
         try:
-            response = requests.post(db_url, json=data)
+            response = self.discovery.request("Storage", "POST", json=data)
             if response.status_code == 201:
                 print(f"Violation registered: {data}")
             else:
                 print(f"Failed to register violation: {response.status_code} - {response.text}")
+        except ServiceUnavailable as e:
+            print(f"Cannot send violation: {e}")
         except Exception as e:
             print(f"Error sending POST to DB adaptor: {e}")
 
@@ -108,7 +91,7 @@ class ViolationDetector:
         while True:
             try:
                 self.resource_info["lastUpdate"] = time.time()
-                response = requests.put(self.catalog_register_url, json=self.resource_info)
+                response = self.catalog_client.refresh()
                 print(f"Registered to catalog: {response.status_code} - {response.text}")
             except Exception as e:
                 print(f"Catalog registration failed: {e}")